@@ -1,734 +1,534 @@
-import requests
+import asyncio
 import json
 import logging
-from datetime import datetime, timedelta
-from homeassistant.core import HomeAssistant, ServiceCall, callback
+from datetime import timedelta
+from functools import partial
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse, callback
+from homeassistant.helpers.debounce import Debouncer
+from homeassistant.helpers.discovery import async_load_platform
+from homeassistant.helpers.entity_registry import EVENT_ENTITY_REGISTRY_UPDATED
+from homeassistant.helpers.event import async_track_state_change_event, async_track_time_interval
+from homeassistant.helpers.group import expand_entity_ids
 from homeassistant.helpers.typing import ConfigType
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.const import (
+    EVENT_HOMEASSISTANT_STARTED, EVENT_HOMEASSISTANT_STOP, STATE_ON,
     CONF_ENTITY_ID, CONF_ACCESS_TOKEN, CONF_STATE, CONF_URL,
     MATCH_ALL, CONF_CLIENT_ID, CONF_CLIENT_SECRET,
-    ATTR_DEVICE_CLASS, ATTR_FRIENDLY_NAME)
+    CONF_TIMEOUT, ATTR_DEVICE_CLASS, ATTR_FRIENDLY_NAME)
 from .alexa_response import AlexaResponse
+from .auth import TokenManager
+from .catalog import CatalogEntry, EndpointCatalog, chunked
+from .const import ATTR_ALEXA_DISPLAY, COMPONENT_DOMAIN, DATA_METRICS
+from .deadline import DEFAULT_DIRECTIVE_TIMEOUT, RESPONSE_RESERVE, Deadline, DeadlineExceeded
+from .debounce import DEFAULT_DEBOUNCE, ReportDebouncer
+from .exposure import ExposureFilter, compile_globs
+from .gateway import DEFAULT_TIMEOUT, GatewayClient, GatewayError
+from .interfaces import get_display, get_interface, get_interfaces
+from .metrics import Metrics, MetricsView
+from .outbox import RetryOutbox, is_retryable
+from .pipeline import EntityLocks, ReportPipeline
+from .ratelimit import DEFAULT_RATE, LANE_BULK, LANE_INTERACTIVE, LANE_REPORT, RateLimiter
+from .utils import FRAGMENTS, SCOPE_TOKEN, splice_json
 
-COMPONENT_DOMAIN = "alexa_gateway"
 CONF_AUTH_URL = "auth_url"
 CONF_COUNTER = "counter"
+CONF_DEBOUNCE = "debounce"
+CONF_AUTO_REPORT = "auto_report"
+CONF_RATE_LIMIT = "rate_limit"
+CONF_DIRECTIVE_TIMEOUT = "directive_timeout"
+CONF_FILTER = "filter"
+CONF_CONFIRM_STATE = "confirm_state"
 DEFAULT_TOKEN_CACHE = "/share/.alexa-gateway.token"
+DEFAULT_OUTBOX = "/share/.alexa-gateway.outbox"
+DEFAULT_DISCOVERED = "/share/.alexa-gateway.discovered"
+DISCOVERY_COOLDOWN = 10
+DISCOVERY_MAX_ENDPOINTS = 300
+DISCOVERY_MAX_BYTES = 256 * 1024
+# Room kept in every report for the event envelope and the scope token
+DISCOVERY_ENVELOPE = 4 * 1024
+DISCOVERY_CONCURRENCY = 2
+COUNTER_INTERVAL = timedelta(seconds=30)
+# Longest wait for the entity state to confirm a directive
+CONFIRM_TIMEOUT = 2
+TRANSITIONAL_STATES = ("opening", "closing", "locking", "unlocking", "unknown", "unavailable")
+DATA_TOKENS = "tokens"
+DATA_CLIENT = "client"
+DATA_CATALOG = "catalog"
+DATA_OUTBOX = "outbox"
+DATA_REPORTED = "reported"
 _LOGGER = logging.getLogger(__name__)
 
 ATTR_MANUFACTURER = "RABCBot"
 ATTR_DESCRIPTION = "RABCBot SmartHome Device"
-ATTR_ALEXA_INTERFACE = "alexa_interface"
-ATTR_ALEXA_DISPLAY = "alexa_display"
+
+DIRECTIVE_TIMERS = {
+    "Alexa.Discovery": "alexa_gateway_discovery_seconds",
+    "Alexa.Authorization": "alexa_gateway_grant_seconds",
+}
+
+# Interfaces that send events rather than state, these are never coalesced
+EVENT_INTERFACES = ["Alexa.DoorbellEventSource"]
 
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    conf = config[COMPONENT_DOMAIN]
+    rate = conf.get(CONF_RATE_LIMIT, DEFAULT_RATE)
+    metrics = Metrics()
+    client = GatewayClient(hass,
+                           conf.get(CONF_URL),
+                           conf.get(CONF_TIMEOUT, DEFAULT_TIMEOUT),
+                           RateLimiter(rate, 2 * rate),
+                           metrics)
+    tokens = TokenManager(hass,
+                          client,
+                          conf.get(CONF_AUTH_URL),
+                          conf.get(CONF_CLIENT_ID),
+                          conf.get(CONF_CLIENT_SECRET),
+                          DEFAULT_TOKEN_CACHE,
+                          metrics)
+    exposed = ExposureFilter(conf.get(CONF_FILTER, {}))
+    catalog = EndpointCatalog(hass, partial(describe_entity, exposed=exposed), DEFAULT_DISCOVERED)
+
+    async def post_body(body, lane, token=None):
+        # Bodies are encoded with a placeholder scope token, so a failed one
+        # can be kept and retried with whatever token is current by then
+        for retry in (False, True):
+            if token is None:
+                token = await tokens.async_get_token()
+            try:
+                await client.async_post_event(token,
+                                              body.replace(SCOPE_TOKEN.encode("utf-8"), token.encode("utf-8")),
+                                              lane)
+                return
+            except GatewayError as err:
+                if err.status != 401 or retry:
+                    raise
+                # Revoked or expired early, retry once with a fresh token
+                tokens.async_invalidate(token)
+                token = None
+
+    async def retry_body(entry):
+        if entry.key is None:
+            await post_body(entry.body.encode("utf-8"), LANE_BULK)
+            return
+        # A pending ChangeReport queues with the live reports of its endpoint,
+        # so neither can overtake the other
+        await pipeline.async_submit(entry.key, entry, send_retry)
+
+    async def send_retry(entry):
+        # A newer report of the endpoint went out or replaced this one meanwhile
+        if not outbox.pending(entry):
+            return
+        await post_body(entry.body.encode("utf-8"), LANE_REPORT)
+
+    outbox = RetryOutbox(hass, DEFAULT_OUTBOX, retry_body)
+    hass.data[COMPONENT_DOMAIN] = {DATA_TOKENS: tokens,
+                                   DATA_CLIENT: client,
+                                   DATA_CATALOG: catalog,
+                                   DATA_OUTBOX: outbox,
+                                   DATA_METRICS: metrics,
+                                   DATA_REPORTED: {}}
+    metrics.add_gauge("alexa_gateway_outbox_entries", outbox.__len__)
+
+    async def send_response(alexa_response, endpoint_fragments=None, token=None, durable=False):
+        alexa_response.set_scope_token(SCOPE_TOKEN)
+        with metrics.timer("alexa_gateway_encode_seconds"):
+            body = alexa_response.encode(endpoint_fragments)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Response posted: %s", body.decode("utf-8"))
+
+        # A newer ChangeReport supersedes any pending one for the same endpoint
+        key = alexa_response.endpoint_id if alexa_response.name == "ChangeReport" else None
+        try:
+            await post_body(body, get_lane(alexa_response), token)
+        except Exception as err:
+            if not durable or not is_retryable(err):
+                raise
+            _LOGGER.warning("Failed to post %s, queued for retry", alexa_response.name)
+            outbox.async_add(key, body.decode("utf-8"))
+            return
+
+        if key is not None:
+            outbox.async_discard(key)
+
+    async def send_report(alexa_response):
+        # A doorbell press retried minutes later would only confuse, it is sent once
+        await send_response(alexa_response, durable=alexa_response.name == "ChangeReport")
+
+    pipeline = ReportPipeline(hass, send_report)
+    await catalog.async_load()
+    catalog.async_start()
+    await tokens.async_start()
+    await outbox.async_start()
+
+    async def send_change_reports(entity_ids):
+        # Every report is built before the first post, from one snapshot of the states
+        tasks = []
+        for entity_id in entity_ids:
+            try:
+                alexa_response = await change_handler(hass, entity_id)
+            except Exception as err:
+                # One entity without a usable value doesn't hold up the others
+                _LOGGER.error("Failed to report change for %s because %s", entity_id, err)
+                hass.data[COMPONENT_DOMAIN][DATA_REPORTED].pop(entity_id, None)
+                continue
+            if alexa_response is not None:
+                tasks.append((entity_id, pipeline.async_submit(entity_id, alexa_response)))
+
+        for (entity_id, _), result in zip(tasks, await asyncio.gather(*(task for _, task in tasks),
+                                                                       return_exceptions=True)):
+            if isinstance(result, Exception):
+                _LOGGER.error("Failed to report change for %s because %s", entity_id, result)
+                # Alexa may have missed these values, report them all next time
+                hass.data[COMPONENT_DOMAIN][DATA_REPORTED].pop(entity_id, None)
+
+    debouncer = ReportDebouncer(hass,
+                                conf.get(CONF_DEBOUNCE, DEFAULT_DEBOUNCE),
+                                send_change_reports)
+
+    counter_id = conf.get(CONF_COUNTER)
+    counted = 0
+    flushing = asyncio.Lock()
+
+    async def flush_counter(now=None):
+        # Directives are counted in memory, the counter entity catches up in the background
+        nonlocal counted
+        # One update at a time, counted only moves once the counter has the value
+        async with flushing:
+            total = metrics.counter("alexa_gateway_directives_total")
+            if total == counted:
+                return
+            state = hass.states.get(counter_id)
+            try:
+                value = int(state.state) + total - counted
+            except (AttributeError, ValueError):
+                _LOGGER.warning("Cannot update counter %s, it has no value", counter_id)
+                return
+            try:
+                await hass.services.async_call("counter", "set_value", {"entity_id": counter_id, "value": value},
+                                               blocking=True)
+            except Exception as err:
+                # The counts stay pending and go with the next update
+                _LOGGER.warning("Cannot update counter %s because %s", counter_id, err)
+                return
+            counted = total
+
+    if counter_id:
+        async_track_time_interval(hass, flush_counter, COUNTER_INTERVAL)
+
+    async def stop(event):
+        debouncer.async_flush_all()
+        if counter_id:
+            await flush_counter()
+        tokens.async_stop()
+        await outbox.async_stop()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, stop)
+
     @callback
     async def report_change(call: ServiceCall) -> None:
-        url = config[COMPONENT_DOMAIN].get(CONF_AUTH_URL)
-        token = await get_token(hass,
-                                url,
-                                config[COMPONENT_DOMAIN].get(
-                                    CONF_CLIENT_ID),
-                                config[COMPONENT_DOMAIN].get(CONF_CLIENT_SECRET))
-        response = await change_handler(hass, call.data.get(CONF_ENTITY_ID))
-        response["event"]["endpoint"]["scope"]["token"] = token
-        _LOGGER.debug("Response posted: %s", response)
-        await hass.async_add_executor_job(post_gateway,
-                                          config[COMPONENT_DOMAIN].get(
-                                              CONF_URL),
-                                          token,
-                                          response)
+        entity_ids = resolve_entity_ids(hass, call.data.get(CONF_ENTITY_ID))
+        events = []
+        changes = []
+        for entity_id in entity_ids:
+            entry = catalog.get(entity_id)
+            if entry is not None and entry.event_source:
+                events.append(entity_id)
+            else:
+                changes.append(entity_id)
+
+        if events:
+            debouncer.async_schedule(events, True)
+        if changes:
+            debouncer.async_schedule(changes)
 
     hass.services.async_register(COMPONENT_DOMAIN,
                                  "report_change",
                                  report_change)
 
+    async def send_discovery(full=False):
+        changed, removed, discovered = catalog.async_get_changes(full)
+        if not changed and not removed:
+            _LOGGER.debug("Discovery unchanged, nothing posted")
+            return
+
+        # Each chunk is encoded and posted on its own, and the generator is only
+        # advanced once a post slot is free, so few chunks are in memory at once
+        token = await tokens.async_get_token()
+        semaphore = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+        tasks = []
+
+        async def post(alexa_response, endpoints):
+            try:
+                await send_response(alexa_response, endpoints, token, durable=True)
+            finally:
+                semaphore.release()
+
+        for alexa_response, endpoints in discovery_handler(changed, removed):
+            await semaphore.acquire()
+            tasks.append(hass.async_create_task(post(alexa_response, endpoints)))
+
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+
+        # Alexa has every endpoint now, or the outbox will deliver it
+        catalog.async_set_discovered(discovered)
+
+    async def update_discovery():
+        # Nothing can be posted before the account is linked, Discover will
+        # report everything once it is
+        if not tokens.linked:
+            _LOGGER.debug("Account not linked, discovery changes not posted")
+            return
+        await send_discovery()
+
+    # Entity registry changes come in bursts, report them together
+    discovery_debouncer = Debouncer(hass,
+                                    _LOGGER,
+                                    cooldown=DISCOVERY_COOLDOWN,
+                                    immediate=False,
+                                    function=update_discovery)
+
     @callback
-    async def process_request(call: ServiceCall) -> None:
-        _LOGGER.debug("Request received: %s", call.data)
-        entity_id = config[COMPONENT_DOMAIN].get(CONF_COUNTER)
-        if entity_id:
-            await hass.services.async_call("counter", "increment", {"entity_id": entity_id})
+    def registry_updated(event):
+        hass.async_create_task(discovery_debouncer.async_call())
+
+    hass.bus.async_listen(EVENT_ENTITY_REGISTRY_UPDATED, registry_updated)
 
+    @callback
+    def started(event):
+        # Report what changed while Home Assistant was down, once every entity is loaded
+        if catalog.discovered:
+            hass.async_create_task(discovery_debouncer.async_call())
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STARTED, started)
+
+    @callback
+    def schedule_report(entity_id, event=False):
+        # Until AcceptGrant, or once LWA rejected the refresh token, every
+        # report would only fail on the token
+        if tokens.linked:
+            debouncer.async_schedule(entity_id, event)
+
+    if conf.get(CONF_AUTO_REPORT, True):
+        async_track_reported_entities(catalog, schedule_report)
+
+    async def send_directive_response(deadline, alexa_response):
+        try:
+            token = await deadline.async_run("token", tokens.async_get_token())
+            await deadline.async_run("post", send_response(alexa_response, token=token))
+        except DeadlineExceeded as err:
+            # Too late for any response, Alexa already told the user
+            _LOGGER.warning("%s missed its deadline in %s after %s", alexa_response.name, err.stage, deadline)
+
+    @callback
+    async def process_request(call: ServiceCall) -> ServiceResponse:
+        deadline = Deadline(conf.get(CONF_DIRECTIVE_TIMEOUT, DEFAULT_DIRECTIVE_TIMEOUT))
+        _LOGGER.debug("Request received: %s", call.data)
         name = call.data["directive"]["header"]["name"]
         namespace = call.data["directive"]["header"]["namespace"]
+        metrics.inc("alexa_gateway_directives_total", namespace=namespace, name=name)
+        # Discovery posts every chunk and AcceptGrant waits for LWA, they would
+        # swamp the latency of the directives Alexa is waiting on
+        with metrics.timer(DIRECTIVE_TIMERS.get(namespace, "alexa_gateway_directive_seconds")):
+            return await process_directive(call, deadline, namespace, name)
+
+    locks = EntityLocks()
+
+    async def serialized(deadline, entity_id, handler, settling=()):
+        # Directives for one endpoint run in arrival order, each against the
+        # state the previous one left, other endpoints are not held up
+        try:
+            await deadline.async_run("lock", locks.async_acquire(entity_id), RESPONSE_RESERVE)
+        except BaseException:
+            handler.close()
+            raise
+        try:
+            alexa_response = await handler
+        except BaseException:
+            locks.release(entity_id)
+            raise
+
+        if settling:
+            # The service call returns before the integration updates the state,
+            # the endpoint stays held until it shows this directive
+            hass.async_create_task(release_settled(entity_id, settling[0]()))
+        else:
+            locks.release(entity_id)
+        return alexa_response
+
+    async def release_settled(entity_id, settled):
+        try:
+            await settled
+        finally:
+            locks.release(entity_id)
 
+    async def process_directive(call, deadline, namespace, name):
         if namespace == "Alexa.Authorization" and name == "AcceptGrant":
             # Use grant code to get first auth token
             code = call.data["directive"]["payload"]["grant"]["code"]
-            await get_token(hass,
-                            config[COMPONENT_DOMAIN].get(CONF_AUTH_URL),
-                            config[COMPONENT_DOMAIN].get(CONF_CLIENT_ID),
-                            config[COMPONENT_DOMAIN].get(CONF_CLIENT_SECRET),
-                            code)
+            await tokens.async_grant(code)
+            # A new link starts without devices, whatever was reported before
+            catalog.async_reset_discovered()
+            if call.return_response:
+                return AlexaResponse(namespace="Alexa.Authorization", name="AcceptGrant.Response").get()
 
         elif namespace == "Alexa.Discovery":
-            response = await discovery_handler(hass, call.data)
-            token = await get_token(hass,
-                                    config[COMPONENT_DOMAIN].get(
-                                        CONF_AUTH_URL),
-                                    config[COMPONENT_DOMAIN].get(
-                                        CONF_CLIENT_ID),
-                                    config[COMPONENT_DOMAIN].get(CONF_CLIENT_SECRET))
-            response["event"]["payload"]["scope"]["token"] = token
-            _LOGGER.debug("Response posted: %s", response)
-            url = config[COMPONENT_DOMAIN].get(CONF_URL)
-            await hass.async_add_executor_job(post_gateway,
-                                              url,
-                                              token,
-                                              response)
-
-        elif name == "ReportState":
-            response = await report_handler(hass, call.data)
-            token = await get_token(hass,
-                                    config[COMPONENT_DOMAIN].get(
-                                        CONF_AUTH_URL),
-                                    config[COMPONENT_DOMAIN].get(
-                                        CONF_CLIENT_ID),
-                                    config[COMPONENT_DOMAIN].get(CONF_CLIENT_SECRET))
-            response["event"]["endpoint"]["scope"]["token"] = token
-            _LOGGER.debug("Response posted: %s", response)
-            await hass.async_add_executor_job(post_gateway,
-                                              config[COMPONENT_DOMAIN].get(
-                                                  CONF_URL),
-                                              token,
-                                              response)
+            if call.return_response:
+                alexa_response, endpoints = discover_handler(hass, call.data)
+                return json.loads(alexa_response.encode(endpoints))
+            # Alexa asks after forgetting its devices, so it gets every endpoint
+            await send_discovery(full=True)
 
         else:
-            response = await service_handler(hass, call.data)
-            token = await get_token(hass,
-                                    config[COMPONENT_DOMAIN].get(
-                                        CONF_AUTH_URL),
-                                    config[COMPONENT_DOMAIN].get(
-                                        CONF_CLIENT_ID),
-                                    config[COMPONENT_DOMAIN].get(CONF_CLIENT_SECRET))
-            response["event"]["endpoint"]["scope"]["token"] = token
-            _LOGGER.debug("Response posted: %s", response)
-            await hass.async_add_executor_job(post_gateway,
-                                              config[COMPONENT_DOMAIN].get(
-                                                  CONF_URL),
-                                              token,
-                                              response)
-
-    hass.services.async_register(COMPONENT_DOMAIN,
-                                 "process_request",
-                                 process_request)
-
-    return True
-
-
-def get_interfaces(domain, attributes):
-    interfaces = []
-    device_class = attributes.get(ATTR_DEVICE_CLASS)
-    override_interface = attributes.get(ATTR_ALEXA_INTERFACE)
-
-    if not override_interface:
-        if domain in ["lock"]:
-            interfaces.append("Alexa.LockController")
-            interfaces.append("Alexa")
+            if name == "ReportState":
+                handler = report_handler(hass, call.data)
+            else:
+                settling = []
+                handler = serialized(deadline,
+                                     call.data["directive"]["endpoint"]["endpointId"],
+                                     service_handler(hass, call.data, deadline, conf.get(CONF_CONFIRM_STATE, False),
+                                                     settling),
+                                     settling)
+            with metrics.timer("alexa_gateway_handler_seconds"):
+                alexa_response = await directive_handler(deadline, call.data, handler)
+
+            # The caller passes the response on to Alexa itself, no gateway round trip
+            if call.return_response:
+                return alexa_response.get()
+            await send_directive_response(deadline, alexa_response)
 
-        if domain in ["light"]:
-            interfaces.append("Alexa.PowerController")
-            interfaces.append("Alexa.BrightnessController")
-            interfaces.append("Alexa.ColorController")
-            interfaces.append("Alexa.ColorTemperatureController")
-            interfaces.append("Alexa")
-
-        elif domain in ["switch", "input_boolean"]:
-            interfaces.append("Alexa.PowerController")
-            interfaces.append("Alexa")
-
-        elif domain in ["script"]:
-            interfaces.append("Alexa.PowerController")
-            interfaces.append("Alexa")
-
-        elif domain in ["climate"]:
-            interfaces.append("Alexa.TemperatureSensor")
-            interfaces.append("Alexa.ThermostatController")
-            interfaces.append("Alexa")
-
-        elif domain in ["sensor", "binary_sensor"]:
-            interfaces.append("Alexa.ContactSensor")
-            interfaces.append("Alexa")
-
-        elif domain in ["cover"] and device_class in ["garage", "door", "gate"]:
-            interfaces.append("Alexa.ModeController")
-            interfaces.append("Alexa")
-
-        elif domain in ["cover"] and device_class in ["awning", "blind", "curtain", "shade", "shutter", "window"]:
-            interfaces.append("Alexa.RangeController")
-            interfaces.append("Alexa")
-
-        elif domain in ["counter"]:
-            interfaces.append("Alexa.RangeController")
-            interfaces.append("Alexa")
-
-    elif override_interface == "Alexa.DoorbellEventSource":
-        interfaces.append("Alexa.DoorbellEventSource")
-
-    elif override_interface != "None":
-        interfaces.append(override_interface)
-        interfaces.append("Alexa")
-
-    return interfaces
-
-
-def get_instance(interface, attributes):
-    device_class = attributes.get(ATTR_DEVICE_CLASS)
-
-    if device_class in ["garage", "door", "gate"]:
-        return  "GarageDoor.Position"
-
-    elif device_class in ["awning", "blind", "curtain", "shade", "shutter", "window"]:
-        return "Blind.Lift"
-
-    elif interface == "Alexa.RangeController":
-        return "Counter.Number"
-
-    else:
         return None
 
-def get_asset_id(attributes):
-    device_class = attributes.get(ATTR_DEVICE_CLASS)
-    if device_class in ["garage", "door", "gate"]:
-        return "Alexa.Setting.Mode"
-        
-    elif device_class in ["awning", "blind", "curtain", "shade", "shutter", "window"]:
-        return "Alexa.Setting.Opening"
-
-    else:
-        return None
-
-
-def get_capability(alexa_response, interface, attributes):
-    device_class = attributes.get(ATTR_DEVICE_CLASS)
-    
-    if interface == "Alexa":
-        capability = alexa_response.create_payload_endpoint_capability()
-
-    elif interface == "Alexa.DoorbellEventSource":
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            proactively_reported=True)
-
-    elif interface in ["Alexa.LockController", "Alexa.BrightnessController", "Alexa.PowerController", "Alexa.TemperatureSensor", "Alexa.ColorController", "Alexa.ColorTemperatureController"]:
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            supported=get_properties(interface),
-            retrievable=True,
-            proactively_reported=True)
-
-    elif interface == "Alexa.ContactSensor":
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            supported=get_properties(interface),
-            retrievable=True,
-            proactively_reported=True)
-
-    elif interface == "Alexa.MotionSensor":
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            supported=get_properties(interface),
-            retrievable=True,
-            proactively_reported=True)
-
-    elif interface == "Alexa.ThermostatController":
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            supported=get_properties(interface),
-            configuration_modes=["HEAT", "COOL", "AUTO", "OFF"],
-            retrievable=False,
-            proactively_reported=True)
-
-    elif interface == "Alexa.RangeController" and device_class in ["awning", "blind", "curtain", "shade", "shutter", "window"]:
-        # TO-DO: Set "rangeValueDelta" from the state attributes step
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            instance=get_instance(interface, attributes),
-            supported=get_properties(interface),
-            retrievable=True,
-            proactively_reported=True,
-            capability_resources={"friendlyNames": [
-                {"@type": "asset", "value": {"assetId": get_asset_id(attributes)}}]},
-            configuration_range={"minimumValue": 0, "maximumValue": 100, "precision": 1},
-            unit_of_measure="Alexa.Unit.Percent",
-            semantics_actions=[
-                  {
-                    "@type": "ActionsToDirective",
-                    "actions": ["Alexa.Actions.Close"],
-                    "directive": {
-                      "name": "SetRangeValue",
-                      "payload": {
-                        "rangeValue": 0
-                      }
-                    }
-                  },
-                  {
-                    "@type": "ActionsToDirective",
-                    "actions": ["Alexa.Actions.Open"],
-                    "directive": {
-                      "name": "SetRangeValue",
-                      "payload": {
-                        "rangeValue": 100
-                      }
-                    }
-                  },
-                  {
-                    "@type": "ActionsToDirective",
-                    "actions": ["Alexa.Actions.Lower"],
-                    "directive": {
-                      "name": "AdjustRangeValue",
-                      "payload": {
-                        "rangeValueDelta" : -10,
-                        "rangeValueDeltaDefault" : False
-                      }
-                    }
-                  },
-                  {
-                    "@type": "ActionsToDirective",
-                    "actions": ["Alexa.Actions.Raise"],
-                    "directive": {
-                      "name": "AdjustRangeValue",
-                      "payload": {
-                        "rangeValueDelta" : 10,
-                        "rangeValueDeltaDefault" : False
-                      }
-                    }
-                  }
-                ],
-            semantics_states=[
-                  {
-                    "@type": "StatesToValue",
-                    "states": ["Alexa.States.Closed"],
-                    "value": 0
-                  },
-                  {
-                    "@type": "StatesToRange",
-                    "states": ["Alexa.States.Open"],
-                    "range": {
-                      "minimumValue": 1,
-                      "maximumValue": 100
-                    }
-                  }  
-                ])
-
-    elif interface == "Alexa.RangeController":
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            instance=get_instance(interface, attributes),
-            supported=get_properties(interface),
-            retrievable=True,
-            proactively_reported=True,
-            capability_resources={"friendlyNames": [
-                {"@type": "text", "value": {"text": "number", "locale": "en-US"}}]},
-            configuration_range={"minimumValue": 0, "maximumValue": 100, "precision": 1})
-
-    elif interface == "Alexa.ModeController" and device_class in ["garage", "door", "gate"]:
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            instance=get_instance(interface, attributes),
-            supported=get_properties(interface),
-            retrievable=True,
-            proactively_reported=True,
-            capability_resources={"friendlyNames": [
-                {"@type": "asset", "value": {"assetId": get_asset_id(attributes)}}]},
-            configuration_modes=[
-                {
-                    "value": "Position.Up",
-                    "modeResources": {
-                        "friendlyNames": [
-                            {
-                                "@type": "asset",
-                                "value": {
-                                    "assetId": "Alexa.Value.Open"
-                                }
-                            },
-                            {
-                                "@type": "text",
-                                "value": {
-                                    "text": "Open",
-                                    "locale": "en-US"
-                                }
-                            }
-                        ]
-                    }
-                },
-                {
-                    "value": "Position.Down",
-                    "modeResources": {
-                        "friendlyNames": [
-                            {
-                                "@type": "asset",
-                                "value": {
-                                    "assetId": "Alexa.Value.Close"
-                                }
-                            },
-                            {
-                                "@type": "text",
-                                "value": {
-                                    "text": "Closed",
-                                    "locale": "en-US"
-                                }
-                            }
-                        ]
-                    }
-                }
-            ],
-            configuration_ordered=False,
-            semantics_actions=[
-                {
-                    "@type": "ActionsToDirective",
-                    "actions": ["Alexa.Actions.Close", "Alexa.Actions.Lower"],
-                    "directive": {
-                        "name": "SetMode",
-                        "payload": {
-                            "mode": "Position.Down"
-                        }
-                    }
-                },
-                {
-                    "@type": "ActionsToDirective",
-                    "actions": ["Alexa.Actions.Open", "Alexa.Actions.Raise"],
-                    "directive": {
-                        "name": "SetMode",
-                        "payload": {
-                            "mode": "Position.Up"
-                        }
-                    }
-                }
-            ],
-            semantics_states=[
-                {
-                    "@type": "StatesToValue",
-                    "states": ["Alexa.States.Closed"],
-                    "value": "Position.Down"
-                },
-                {
-                    "@type": "StatesToValue",
-                    "states": ["Alexa.States.Open"],
-                    "value": "Position.Up"
-                }
-            ])
-
-    elif interface == "Alexa.EventDetectionSensor":
-        capability = alexa_response.create_payload_endpoint_capability(
-            interface=interface,
-            supported=get_properties(interface),
-            retrievable=False,
-            proactively_reported=True)
-
-    else:
-        raise Exception(
-            f"Capability not yet implemented for Interface: {interface}")
-
-    return capability
-
-
-def get_display(domain, attributes):
-    device_class = attributes.get(ATTR_DEVICE_CLASS)
-
-    if domain in ["light"]:
-        return "LIGHT"
-
-    elif domain in ["lock"]:
-        return "SMARTLOCK"
-
-    elif domain in ["script"]:
-        return "ACTIVITY_TRIGGER"
-
-    elif domain in ["climate"]:
-        return "THERMOSTAT"
-
-    elif domain in ["camera"]:
-        return "CAMERA"
-
-    elif device_class in ["garage"]:
-        return "GARAGE_DOOR"
-
-    elif device_class in ["door", "gate"]:
-        return "DOOR"
-        
-    elif device_class in ["awning", "blind", "curtain", "shade", "shutter", "window"]:
-        return "INTERIOR_BLIND"
-
-    else:
-        return "OTHER"
-
-
-def get_properties(interface):
-    if interface == "Alexa.ContactSensor":
-        return [{"name": "detectionState"}]
-
-    elif interface == "Alexa.MotionSensor":
-        return [{"name": "detectionState"}]
-
-    elif interface == "Alexa.TemperatureSensor":
-        return [{"name": "temperature"}]
-
-    elif interface == "Alexa.ThermostatController":
-        return [{"name": "targetSetpoint"},
-                {"name": "thermostatMode"},
-                {"name": "lowerSetpoint"},
-                {"name": "upperSetpoint"}]
-
-    elif interface == "Alexa.PowerController":
-        return [{"name": "powerState"}]
-
-    elif interface == "Alexa.BrightnessController":
-        return [{"name": "brightness"}]
-
-    elif interface == "Alexa.ColorController":
-        return [{"name": "color"}]
-
-    elif interface == "Alexa.ColorTemperatureController":
-        return [{"name": "colorTemperatureInKelvin"}]
-
-    elif interface == "Alexa.EventDetectionSensor":
-        return [{"name": "humanPresenceDetectionState"}]
-
-    elif interface == "Alexa.DoorbellEventSource":
-        return []
-
-    elif interface == "Alexa.ModeController":
-        return [{"name": "mode"}]
-
-    elif interface == "Alexa.RangeController":
-        return [{"name": "rangeValue"}]
-
-    elif interface == "Alexa.LockController":
-        return [{"name": "lockState"}]
-
-    else:
-        raise Exception(
-            f"Supported Property not yet implemented for Interface: {interface}")
+    hass.services.async_register(COMPONENT_DOMAIN,
+                                 "process_request",
+                                 process_request,
+                                 supports_response=SupportsResponse.OPTIONAL)
 
+    hass.http.register_view(MetricsView(metrics))
+    hass.async_create_task(async_load_platform(hass, "sensor", COMPONENT_DOMAIN, {}, config))
 
-def get_propertyvalue(name, state):
-    if name == "humanPresenceDetectionState":
-        property_value = {"value": "DETECTED"}
+    return True
 
-    elif name == "detectionState":
-        if state.state.lower() == "open" or state.state.lower() == "on":
-            property_value = "DETECTED"
-        else:
-            property_value = "NOT_DETECTED"
 
-    elif name == "temperature" and state.domain == "sensor":
-        property_value = {"value": state.state, "scale": "FAHRENHEIT"}
+def get_lane(alexa_response):
+    # Directive responses and doorbell presses have someone waiting on them
+    if alexa_response.namespace == "Alexa.Discovery":
+        return LANE_BULK
+    elif alexa_response.name == "ChangeReport":
+        return LANE_REPORT
+    return LANE_INTERACTIVE
 
-    elif name == "temperature" and state.domain == "climate":
-        property_value = {"value": state.attributes.get(
-            "current_temperature"), "scale": "FAHRENHEIT"}
 
-    elif name == "targetSetpoint" and state.domain == "climate":
-        property_value = {"value": state.attributes.get(
-            "current_temperature"), "scale": "FAHRENHEIT"}
+def resolve_entity_ids(hass, targets):
+    """Expand entity ids, groups and glob patterns like binary_sensor.*_door."""
+    if isinstance(targets, str):
+        targets = [target.strip() for target in targets.split(",")]
 
-    elif name == "lowerSetpoint" and state.domain == "climate":
-        property_value = {"value": state.attributes.get(
-            "target_temp_low"), "scale": "FAHRENHEIT"}
+    patterns = [target for target in targets if any(char in target for char in "*?[")]
+    entity_ids = expand_entity_ids(hass, [target for target in targets if target not in patterns])
+    if patterns:
+        pattern = compile_globs(patterns)
+        entity_ids.extend(entity_id for entity_id in hass.states.async_entity_ids() if pattern.match(entity_id))
 
-    elif name == "upperSetpoint" and state.domain == "climate":
-        property_value = {"value": state.attributes.get(
-            "target_temp_high"), "scale": "FAHRENHEIT"}
+    return list(dict.fromkeys(entity_ids))
 
-    elif name == "thermostatMode" and state.domain == "climate":
-        property_value = state.state.upper()
-        if property_value == "HEAT_COOL":
-            property_value = "AUTO"
 
-    elif name == "mode":
-        if state.state.lower() == "open":
-            property_value = "Position.Up"
-        elif state.state.lower() == "closed":
-            property_value = "Position.Down"
+def async_track_reported_entities(catalog, schedule):
+    @callback
+    def entity_changed(entry, old_state, new_state):
+        if not entry.reported:
+            return
+
+        if entry.event_source:
+            # Event sources fire once per activation, not on every state change
+            if new_state.state == STATE_ON and (old_state is None or old_state.state != STATE_ON):
+                schedule(new_state.entity_id, True)
         else:
-            property_value = "INVALID"
-
-    elif name == "rangeValue" and state.domain == "cover":
-        property_value = state.attributes.get("current_position")
-
-    elif name == "rangeValue" and state.domain != "cover":
-        property_value = int(state.state)
+            schedule(new_state.entity_id)
 
-    elif name == "color":
-        property_value = {
-            "hue": 0.0,
-            "saturation": 0.0,
-            "brightness": 0.0
-        }
+    catalog.async_add_listener(entity_changed)
 
-    elif name == "colorTemperatureInKelvin":
-        property_value = 0
 
-    else:
-        property_value = state.state.upper()
+def describe_entity(state, signature, exposed=None):
+    if exposed is not None and not exposed(state.entity_id, state.attributes.get(ATTR_DEVICE_CLASS)):
+        return CatalogEntry(signature, (), None, False, False)
 
-    return property_value
+    interfaces = get_interfaces(state.domain, state.attributes)
+    if not interfaces:
+        return CatalogEntry(signature, interfaces, None, False, False)
 
+    alexa_response = AlexaResponse()
+    display_category = state.attributes.get(ATTR_ALEXA_DISPLAY, get_display(state.domain, state.attributes))
+    capabilities = []
+    for interface in interfaces:
+        capabilities.append(get_interface(interface).capability_fragment(state.attributes))
+
+    endpoint = alexa_response.create_payload_endpoint(
+        endpoint_id=state.entity_id,
+        friendly_name=state.attributes.get(ATTR_FRIENDLY_NAME),
+        description=ATTR_DESCRIPTION,
+        manufacturer_name=ATTR_MANUFACTURER,
+        display_categories=[display_category],
+        capabilities=FRAGMENTS)
+    endpoint = splice_json(endpoint, capabilities)
+
+    return CatalogEntry(signature,
+                        interfaces,
+                        endpoint,
+                        any(interface != "Alexa" for interface in interfaces),
+                        any(interface in EVENT_INTERFACES for interface in interfaces))
+
+
+def discovery_handler(changed, removed):
+    # Only the endpoints added, changed or removed since the last report,
+    # split in reports bounded by endpoint count and size
+
+    # The cached endpoint descriptors are already encoded, they are spliced
+    # into the report body when it is encoded, one comma apart
+    for chunk in chunked(changed, DISCOVERY_MAX_ENDPOINTS, DISCOVERY_MAX_BYTES - DISCOVERY_ENVELOPE,
+                         lambda entry: len(entry.endpoint) + 1):
+        alexa_response = AlexaResponse(namespace="Alexa.Discovery",
+                                       name="AddOrUpdateReport",
+                                       payload={"scope": {"type": "BearerToken", "token": ""}})
+        yield alexa_response, [entry.endpoint for entry in chunk]
+
+    for chunk in chunked(removed, DISCOVERY_MAX_ENDPOINTS):
+        alexa_response = AlexaResponse(namespace="Alexa.Discovery",
+                                       name="DeleteReport",
+                                       payload={"scope": {"type": "BearerToken", "token": ""}})
+        alexa_response.set_payload_endpoint([{"endpointId": entity_id} for entity_id in chunk])
+        yield alexa_response, None
+
+
+def discover_handler(hass, request):
+    # Answering Discover replaces everything Alexa knows, so it holds every endpoint
+    catalog = hass.data[COMPONENT_DOMAIN][DATA_CATALOG]
+    catalog.async_reset_discovered()
+    changed, _, discovered = catalog.async_get_changes()
+    catalog.async_set_discovered(discovered)
 
-async def discovery_handler(hass, request):
-    # Prepare the Alexa response
     alexa_response = AlexaResponse(namespace="Alexa.Discovery",
-                                   name="AddOrUpdateReport",
-                                   payload={"scope": {"type": "BearerToken", "token": ""}})
-
-    # Append alexa endpoint for each entity
-    entities = hass.states.async_entity_ids()
-    for entity_id in entities:
-        state = hass.states.get(entity_id)
-
-        display_category = state.attributes.get(ATTR_ALEXA_DISPLAY, get_display(state.domain, state.attributes))
-        capabilities = []
-        for interface in get_interfaces(state.domain, state.attributes):
-            capabilities.append(get_capability(alexa_response, interface, state.attributes))
-
-        if len(capabilities) > 0:
-            alexa_response.add_payload_endpoint(
-                endpoint_id=entity_id,
-                friendly_name=state.attributes.get(ATTR_FRIENDLY_NAME),
-                description=ATTR_DESCRIPTION,
-                manufacturer_name=ATTR_MANUFACTURER,
-                display_categories=[display_category],
-                capabilities=capabilities)
-
-    return alexa_response.get()
-
+                                   name="Discover.Response",
+                                   correlation_token=request["directive"]["header"].get("correlationToken"))
+    return alexa_response, [entry.endpoint for entry in changed]
 
-def get_service(interface, name, payload, state):
-
-    if interface == "Alexa.ModeController" and name == "SetMode":
-        if payload["mode"] == "Position.Up":
-            service = "open_cover"
-        else:
-            service = "close_cover"
-        data = {"entity_id": state.entity_id}
-
-    elif interface == "Alexa.RangeController" and name == "AdjustRangeValue" and state.domain == "cover":
-        service = "set_cover_position"
-        data = {"entity_id": state.entity_id, "position": state.attributes.get("current_position") + payload["rangeValueDelta"]}
-
-    elif interface == "Alexa.RangeController" and name == "SetRangeValue" and state.domain == "cover":
-        service = "set_cover_position"
-        data = {"entity_id": state.entity_id, "position": payload["rangeValue"]}
-
-    elif interface == "Alexa.RangeController" and name == "AdjustRangeValue":
-        if payload["rangeValueDelta"] > 0:
-            service = "increment"
-        else:
-            service = "decrement"
-        data = {"entity_id": state.entity_id}
-
-    elif interface == "Alexa.RangeController" and name == "SetRangeValue":
-        service = "configure"
-        data = {"entity_id": state.entity_id, "value": payload["rangeValue"]}
-
-    elif interface == "Alexa.LockController":
-        service = name.lower()
-        data = {"entity_id": state.entity_id}
-
-    elif interface == "Alexa.PowerController":
-        if name == "TurnOff":
-            service = "turn_off"
-        else:
-            service = "turn_on"
-        data = {"entity_id": state.entity_id}
-
-    elif interface == "Alexa.BrightnessController":
-        service = "turn_on"
-        data = {"entity_id": state.entity_id,
-                "brightness_pct": payload["brightness"]}
-
-    elif interface == "Alexa.ColorController" and name == "SetColor":
-        service = "turn_on"
-        data = {"entity_id": state.entity_id,
-                "hs_color": [payload["color"]["hue"], 100 * payload["color"]["saturation"]]}
-
-    elif interface == "Alexa.ColorTemperatureController" and name == "SetColorTemperature":
-        service = "turn_on"
-        data = {"entity_id": state.entity_id,
-                "kelvin": payload["colorTemperatureInKelvin"]}
-
-    elif interface == "Alexa.ThermostatController" and name == "AdjustTargetTemperature":
-        service = "set_temperature"
-        data = {"entity_id": state.entity_id}
-        data["target_temp_high"] = state.attributes.get(
-            "target_temp_high") + payload["targetSetpointDelta"]["value"]
-        data["target_temp_low"] = state.attributes.get(
-            "target_temp_low") + payload["targetSetpointDelta"]["value"]
-
-    elif interface == "Alexa.ThermostatController" and name == "SetTargetTemperature":
-        service = "set_temperature"
-        data = {"entity_id": state.entity_id}
-        if "upperSetpoint" in payload: data["target_temp_high"] = payload["upperSetpoint"]["value"]
-        if "lowerSetpoint" in payload: data["target_temp_low"] = payload["lowerSetpoint"]["value"]
-        if "targetSetpoint" in payload: 
-            data["target_temp_high"] = payload["targetSetpoint"]["value"] + 4
-            data["target_temp_low"] = payload["targetSetpoint"]["value"] - 4
-
-    else:
-        raise Exception(
-            f"Service not yet implemented for Interface: {interface}; name: {name}")
-
-    return service, data
-
-
-def get_futurevalue(name, service, data, state):
-
-    if service == "open_cover":
-        return "Position.Up"
-
-    elif service == "close_cover":
-        return "Position.Down"
-
-    elif service == "increment":
-        return int(state.state) + 1
-
-    elif service == "decrement":
-        return int(state.state) - 1
-
-    elif service == "configure":
-        return data["value"]
-
-    elif service == "set_cover_position":
-        return data["position"]
-
-    elif service == "turn_off":
-        return "OFF"
-
-    elif service == "turn_on":
-        return "ON"
-
-    elif service == "lock":
-        return "LOCKED"
-
-    elif service == "unlock":
-        return "UNLOCKED"
-
-    elif "brightness_pct" in data:
-        return data["brightness_pct"]
-
-    elif name == "thermostatMode":
-        return {"value": state.state}
-
-    elif name == "lowerSetpoint":
-        return {"value": data["target_temp_low"], "scale": "FAHRENHEIT"}
-
-    elif name == "upperSetpoint":
-        return {"value": data["target_temp_high"], "scale": "FAHRENHEIT"}
-
-    elif name == "targetSetpoint":
-        return {"value": state.attributes.get("current_temperature"), "scale": "FAHRENHEIT"}
-        
-    else:
-        raise Exception(
-            f"Future value not yet implemented for name: {name}; service: {service}")
 
+async def directive_handler(deadline, request, handler):
+    name = request["directive"]["header"]["name"]
+    try:
+        return await handler
+    except DeadlineExceeded as err:
+        _LOGGER.warning("Directive %s missed its deadline in %s after %s", name, err.stage, deadline)
+        return error_handler(request, "ENDPOINT_UNREACHABLE", "Device did not respond in time")
+    except Exception as err:
+        _LOGGER.error("Directive %s failed because %s", name, err)
+        return error_handler(request, "INTERNAL_ERROR", str(err))
 
 
-async def service_handler(hass, request):
+async def service_handler(hass, request, deadline, confirm=False, settling=None):
     # Extract Alexa request values and map to Home-Assistant
     name = request["directive"]["header"]["name"]
     interface = request["directive"]["header"]["namespace"]
@@ -736,32 +536,128 @@ async def service_handler(hass, request):
     scope_token = request["directive"]["endpoint"]["scope"]["token"]
     entity_id = request["directive"]["endpoint"]["endpointId"]
     payload = request["directive"]["payload"]
+    if not is_exposed(hass, entity_id):
+        return error_handler(request, "NO_SUCH_ENDPOINT", "{} is not exposed to Alexa".format(entity_id))
 
     # Retrieve current HASS state
     state = hass.states.get(entity_id)
 
     # Call HASS Service
-    service, data = get_service(interface, name, payload, state)
+    handler = get_interface(interface)
+    service, data = handler.get_service(name, payload, state)
     _LOGGER.debug(
         "Hass Services Call, with domain: %s, service: %s and payload: %s", state.domain, service, data)
-    await hass.services.async_call(state.domain, service, data)
+    # Predicted from the state before the call, in case it can't be confirmed
+    predicted = [handler.future_value(prop, service, data, state) for prop in handler.properties]
+    previous = settled_values(handler, state)
+    confirmed = None
+    settle = None
+    if handler.confirmable and (confirm or settling is not None):
+        # Listen before calling, the state may change before the call returns
+        matched = asyncio.get_running_loop().create_future()
+
+        @callback
+        def state_changed(event):
+            new_state = event.data.get("new_state")
+            if not matched.done() and new_state is not None and reflects(handler, new_state, predicted, previous):
+                matched.set_result(new_state)
+
+        unsubscribe = async_track_state_change_event(hass, [entity_id], state_changed)
+        try:
+            await call_service(hass, deadline, state.domain, service, data)
+            if confirm:
+                confirmed = await confirm_state(hass, deadline, handler, entity_id, matched, predicted, previous)
+            elif settling is not None:
+                # Answered right away, the caller waits for the state after that
+                settle = partial(settle_state, hass, handler, entity_id, matched, predicted, previous, unsubscribe)
+        finally:
+            if settle is None:
+                unsubscribe()
+    else:
+        await call_service(hass, deadline, state.domain, service, data)
 
     # Return an Alexa reponse
     alexa_response = AlexaResponse(correlation_token=correlation_token,
                                    scope_token=scope_token,
                                    endpoint_id=entity_id)
 
-    instance = get_instance(interface, state.attributes)
+    instance = handler.instance(state.attributes)
 
-    # TO-DO: Dont use future value
-    for prop in get_properties(interface):
+    for prop, value in zip(handler.properties, predicted):
+        if confirmed is not None:
+            value = handler.property_value(prop, confirmed)
         alexa_response.add_context_property(
             namespace=interface,
             instance=instance,
-            name=prop["name"],
-            value=get_futurevalue(prop["name"], service, data, state))
+            name=prop,
+            value=value)
+
+    if settle is not None:
+        settling.append(settle)
+    return alexa_response
+
+
+async def call_service(hass, deadline, domain, service, data):
+    # A missed deadline only stops waiting, the device action still runs to the end
+    call = hass.async_create_task(hass.services.async_call(domain, service, data, blocking=True))
+    try:
+        await deadline.async_run("service", asyncio.shield(call), RESPONSE_RESERVE)
+    except DeadlineExceeded:
+        call.add_done_callback(partial(late_service_done, domain, service))
+        raise
+
 
-    return alexa_response.get()
+def late_service_done(domain, service, call):
+    if not call.cancelled() and call.exception() is not None:
+        _LOGGER.error("Service %s.%s failed after its deadline because %s", domain, service, call.exception())
+
+
+async def confirm_state(hass, deadline, handler, entity_id, matched, predicted, previous):
+    """Return the entity state once it settles on new or the predicted values, None if it doesn't in time."""
+    if matched.done():
+        return matched.result()
+    state = hass.states.get(entity_id)
+    if reflects(handler, state, predicted, previous):
+        return state
+
+    try:
+        return await deadline.async_run("confirm", asyncio.wait_for(asyncio.shield(matched), CONFIRM_TIMEOUT),
+                                        RESPONSE_RESERVE)
+    except DeadlineExceeded:
+        _LOGGER.debug("State of %s not confirmed in time, reporting the predicted values", entity_id)
+        return None
+
+
+async def settle_state(hass, handler, entity_id, matched, predicted, previous, unsubscribe):
+    """Wait at most CONFIRM_TIMEOUT for the entity state to show the directive."""
+    try:
+        if not matched.done() and not reflects(handler, hass.states.get(entity_id), predicted, previous):
+            await asyncio.wait_for(asyncio.shield(matched), CONFIRM_TIMEOUT)
+    except asyncio.TimeoutError:
+        _LOGGER.debug("State of %s did not settle in time, next directive goes ahead", entity_id)
+    finally:
+        unsubscribe()
+
+
+def reflects(handler, state, predicted, previous):
+    # The device may land elsewhere than predicted, a counter with a larger step
+    # or a cover stopped short, the first settled change confirms the directive
+    values = settled_values(handler, state)
+    return values is not None and (values == targeted(handler, predicted) or values != previous)
+
+
+def settled_values(handler, state):
+    # Only the properties a directive sets, an ambient temperature tick is no answer
+    if state is None or state.state in TRANSITIONAL_STATES:
+        return None
+    try:
+        return targeted(handler, [handler.property_value(prop, state) for prop in handler.properties])
+    except (TypeError, ValueError):
+        return None
+
+
+def targeted(handler, values):
+    return [value for prop, value in zip(handler.properties, values) if prop not in handler.untargeted]
 
 
 async def report_handler(hass, request):
@@ -769,6 +665,8 @@ async def report_handler(hass, request):
     correlation_token = request["directive"]["header"]["correlationToken"]
     scope_token = request["directive"]["endpoint"]["scope"]["token"]
     entity_id = request["directive"]["endpoint"]["endpointId"]
+    if not is_exposed(hass, entity_id):
+        return error_handler(request, "NO_SUCH_ENDPOINT", "{} is not exposed to Alexa".format(entity_id))
 
     # Prepare Alexa reponse
     alexa_response = AlexaResponse(name="StateReport",
@@ -779,128 +677,86 @@ async def report_handler(hass, request):
     # Retrieve HASS state
     state = hass.states.get(entity_id)
 
-    interfaces = get_interfaces(state.domain, state.attributes)
-    if "Alexa" in interfaces: interfaces.remove("Alexa")
-    for interface in interfaces:
-        instance = get_instance(interface, state.attributes)
+    for interface in get_interfaces(state.domain, state.attributes):
+        if interface == "Alexa":
+            continue
+        handler = get_interface(interface)
+        instance = handler.instance(state.attributes)
 
-        for prop in get_properties(interface):
+        for prop in handler.properties:
             alexa_response.add_context_property(
                 namespace=interface,
                 instance=instance,
-                name=prop["name"],
-                value=get_propertyvalue(prop["name"], state))
-
-    return alexa_response.get()
-
-
-async def change_handler(hass, entity_id):
-    # Retrieve HASS state
-    state = hass.states.get(entity_id)
-
-    interfaces = get_interfaces(state.domain, state.attributes)
-    if "Alexa" in interfaces: interfaces.remove("Alexa")
-    for interface in interfaces:
-        instance = get_instance(interface, state.attributes)
-
-        props = get_properties(interface)
-        if len(props) > 0:
-            alexa_response = AlexaResponse(namespace="Alexa",
-                                           name="ChangeReport",
-                                           endpoint_id=entity_id)
-            for prop in props:
-                alexa_response.add_payload_property(namespace=interface,
-                                                    instance=instance,
-                                                    name=prop["name"],
-                                                    value=get_propertyvalue(prop["name"], state))
+                name=prop,
+                value=handler.property_value(prop, state))
 
-        else:
-            alexa_response = AlexaResponse(namespace="Alexa.DoorbellEventSource",
-                                           name="DoorbellPress",
-                                           endpoint_id=entity_id)
-            alexa_response.add_payload_timestamp()
+    return alexa_response
 
-    return alexa_response.get()
 
+def is_exposed(hass, entity_id):
+    entry = hass.data[COMPONENT_DOMAIN][DATA_CATALOG].get(entity_id)
+    return entry is not None and entry.endpoint is not None
 
-def post_gateway(url, token, payload):
-    try:
-        headers = {"Authorization": "Bearer {}".format(token),
-                   "Content-Type": "application/json;charset=UTF-8"}
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        _LOGGER.debug("Alexa Gateway post response: %s %s",
-                      str(response.status_code), response.text)
-    except Exception as err:
-        _LOGGER.error(
-            "Failed to send event to Alexa gateway because %s %s", str(err), response.text)
-        raise err
-
-
-async def get_token(hass, url, client_id, client_secret, code=None):
-    cfg = await hass.async_add_executor_job(read_config, DEFAULT_TOKEN_CACHE)
-
-    dt = datetime.now()
-    if code is not None:
-        _LOGGER.debug("First time auth, need new token...")
-        token, refresh = await hass.async_add_executor_job(grant_token, url, client_id, client_secret, code)
-        cfg["access_token"] = token
-        cfg["refresh_token"] = refresh
-        cfg["expiration"] = str(dt + timedelta(seconds=3600))
-        await hass.async_add_executor_job(write_config, DEFAULT_TOKEN_CACHE, cfg)
-    elif cfg["expiration"] < str(dt):
-        _LOGGER.debug("Token expired, refreshing token...")
-        token, refresh = await hass.async_add_executor_job(refresh_token, url, client_id, client_secret, cfg["refresh_token"])
-        cfg["access_token"] = token
-        cfg["refresh_token"] = refresh
-        cfg["expiration"] = str(dt + timedelta(seconds=3600))
-        await hass.async_add_executor_job(write_config, DEFAULT_TOKEN_CACHE, cfg)
-    else:
-        token = cfg["access_token"]
-    return token
 
-
-def grant_token(url, client_id, client_secret, code):
-    try:
-        headers = {
-            "content-type": "application/x-www-form-urlencoded;charset=UTF-8"}
-        payload = "grant_type=authorization_code&code={}&client_id={}&client_secret={}".format(
-            code, client_id, client_secret)
-        _LOGGER.debug(payload)
-        response = requests.post(url, headers=headers, data=payload)
-        response.raise_for_status()
-        payload = response.json()
-        return payload["access_token"], payload["refresh_token"]
-    except Exception as err:
-        _LOGGER.error("Failed to grant token because %s", str(err))
+def error_handler(request, error_type, message):
+    return AlexaResponse(namespace="Alexa",
+                         name="ErrorResponse",
+                         correlation_token=request["directive"]["header"].get("correlationToken"),
+                         scope_token=request["directive"]["endpoint"]["scope"]["token"],
+                         endpoint_id=request["directive"]["endpoint"]["endpointId"],
+                         payload={"type": error_type, "message": message})
 
 
-def refresh_token(url, client_id, client_secret, token):
-    try:
-        headers = {
-            "content-type": "application/x-www-form-urlencoded;charset=UTF-8"}
-        payload = "grant_type=refresh_token&refresh_token={}&client_id={}&client_secret={}".format(
-            token, client_id, client_secret)
-        _LOGGER.debug(payload)
-        response = requests.post(url, headers=headers, data=payload)
-        response.raise_for_status()
-        payload = response.json()
-        return payload["access_token"], payload["refresh_token"]
-    except Exception as err:
-        _LOGGER.error("Failed to refresh token, because %s", str(err))
+async def change_handler(hass, entity_id):
+    # Retrieve HASS state
+    state = hass.states.get(entity_id)
+    if state is None:
+        _LOGGER.warning("Cannot report change for unknown entity %s", entity_id)
+        return None
+    if not is_exposed(hass, entity_id):
+        _LOGGER.debug("Not reporting %s, it is not exposed to Alexa", entity_id)
+        return None
 
+    interfaces = [interface for interface in get_interfaces(state.domain, state.attributes)
+                  if interface != "Alexa"]
+    if any(not get_interface(interface).properties for interface in interfaces):
+        alexa_response = AlexaResponse(namespace="Alexa.DoorbellEventSource",
+                                       name="DoorbellPress",
+                                       endpoint_id=entity_id)
+        alexa_response.add_payload_timestamp()
+        return alexa_response
 
-def read_config(filename):
-    try:
-        with open(filename, "r") as f:
-            return json.load(f)
-    except IOError as ex:
-        _LOGGER.error("Failed to read configuration file, because %s", ex)
+    values = {}
+    for interface in interfaces:
+        handler = get_interface(interface)
+        instance = handler.instance(state.attributes)
+        for prop in handler.properties:
+            values[(interface, instance, prop)] = handler.property_value(prop, state)
+
+    # Only the properties that changed since the last report go in the change,
+    # the others in the context, and nothing is sent if none changed
+    reported = hass.data[COMPONENT_DOMAIN][DATA_REPORTED]
+    previous = reported.get(entity_id, {})
+    changed = {key for key, value in values.items()
+               if key not in previous or previous[key] != value or get_interface(key[0]).always_report}
+    if not changed:
+        # Properties that are gone don't make a report, it would have no change
+        _LOGGER.debug("No property of %s changed, report suppressed", entity_id)
+        return None
+    reported[entity_id] = values
+    if values.keys() != previous.keys():
+        # The interfaces changed, every property is news to Alexa
+        changed = values.keys()
 
+    alexa_response = AlexaResponse(namespace="Alexa",
+                                   name="ChangeReport",
+                                   endpoint_id=entity_id)
+    for key, value in values.items():
+        interface, instance, prop = key
+        if key not in changed:
+            add_property = alexa_response.add_context_property
+        else:
+            add_property = alexa_response.add_payload_property
+        add_property(namespace=interface, instance=instance, name=prop, value=value)
 
-def write_config(filename, config):
-    try:
-        with open(filename, "w") as f:
-            json.dump(config, f)
-    except IOError as ex:
-        _LOGGER.error("Failed to write configuration file, because %s", ex)
+    return alexa_response
@@ -11,75 +11,77 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import itertools
 import random
 import uuid
 
-from .utils import get_utc_timestamp
+from .utils import FRAGMENTS, get_utc_timestamp, json_encode, splice_json
 
+# Message ids keep the UUID layout: a random prefix per process and a counter
+_MESSAGE_PREFIX = str(uuid.uuid4())[:24]
+_MESSAGE_COUNTER = itertools.count()
 
-class AlexaResponse:
+# Responses without an endpoint: AcceptGrant, Discover and discovery reports
+_NO_ENDPOINT = frozenset(["AcceptGrant.Response", "Discover.Response", "AddOrUpdateReport", "DeleteReport"])
 
-    def __init__(self, **kwargs):
 
-        self.context_properties = []
-        self.payload_endpoints = []
-        self.payload_properties = []
-        self.payload_timestamp = None
+def new_message_id():
+    return "%s%012x" % (_MESSAGE_PREFIX, next(_MESSAGE_COUNTER) & 0xFFFFFFFFFFFF)
 
-        # Set up the response structure
-        self.context = {}
-        self.event = {
-            "header": {
-                "namespace": kwargs.get("namespace", "Alexa"),
-                "name": kwargs.get("name", "Response"),
-                "messageId": str(uuid.uuid4()),
-                "payloadVersion": kwargs.get("payload_version", "3")
-            },
-            "endpoint": {
-                "scope": {
-                    "type": "BearerToken",
-                    "token": kwargs.get("scope_token", "INVALID")
-                },
-                "endpointId": kwargs.get("endpoint_id", "INVALID")
-            },
-            "payload": kwargs.get("payload", {})
-        }
 
-        if "correlation_token" in kwargs:
-            self.event["header"]["correlationToken"] = kwargs.get("correlation_token", "INVALID")
+class AlexaResponse:
+    __slots__ = ("namespace", "name", "payload_version", "message_id", "correlation_token",
+                 "scope_token", "endpoint_id", "cookie", "payload", "timestamp",
+                 "context_properties", "payload_endpoints", "payload_properties", "payload_timestamp")
 
-        if "cookie" in kwargs:
-            self.event["endpoint"]["cookie"] = kwargs.get("cookie", "{}")
+    def __init__(self, **kwargs):
 
-        # No endpoint in an AcceptGrant or Discover request
-        if self.event["header"]["name"] == "AcceptGrant.Response" or self.event["header"]["name"] == "Discover.Response":
-            self.event.pop("endpoint")
+        self.namespace = kwargs.get("namespace", "Alexa")
+        self.name = kwargs.get("name", "Response")
+        self.payload_version = kwargs.get("payload_version", "3")
+        self.message_id = new_message_id()
+        self.correlation_token = kwargs.get("correlation_token")
+        self.scope_token = kwargs.get("scope_token")
+        self.endpoint_id = kwargs.get("endpoint_id", "INVALID")
+        self.cookie = kwargs.get("cookie")
+        self.payload = kwargs.get("payload")
+
+        # One sample time for every property of the response
+        self.timestamp = get_utc_timestamp()
+
+        self.context_properties = None
+        self.payload_endpoints = None
+        self.payload_properties = None
+        self.payload_timestamp = None
 
     def add_context_property(self, **kwargs):
+        if self.context_properties is None:
+            self.context_properties = []
         self.context_properties.append(self.create_property(**kwargs))
 
     def add_payload_property(self, **kwargs):
+        if self.payload_properties is None:
+            self.payload_properties = []
         self.payload_properties.append(self.create_property(**kwargs))
 
     def add_cookie(self, key, value):
-
-        if "cookies" in self is None:
-            self.cookies = {}
-
-        self.cookies[key] = value
+        self.cookie = dict(self.cookie or {})
+        self.cookie[key] = value
 
     def add_payload_endpoint(self, **kwargs):
+        if self.payload_endpoints is None:
+            self.payload_endpoints = []
         self.payload_endpoints.append(self.create_payload_endpoint(**kwargs))
 
     def add_payload_timestamp(self):
-        self.payload_timestamp = get_utc_timestamp()
+        self.payload_timestamp = self.timestamp
 
     def create_property(self, **kwargs):
         prop = {
             "namespace": kwargs.get("namespace", "Alexa.EndpointHealth"),
             "name": kwargs.get("name", "connectivity"),
             "value": kwargs.get("value", {"value": "OK"}),
-            "timeOfSample": get_utc_timestamp(),
+            "timeOfSample": self.timestamp,
             "uncertaintyInMilliseconds": kwargs.get("uncertainty_in_milliseconds", 0)
         }
         instance = kwargs.get("instance", None)
@@ -163,27 +165,53 @@ class AlexaResponse:
         return capability
 
     def get(self, remove_empty=True):
-
-        response = {
-            "context": self.context,
-            "event": self.event
+        # Builds a new structure on every call, the response itself is never modified.
+        # The header is a literal on purpose, copying a shared skeleton is slower
+        header = {
+            "namespace": self.namespace,
+            "name": self.name,
+            "messageId": self.message_id,
+            "payloadVersion": self.payload_version
         }
+        if self.correlation_token is not None:
+            header["correlationToken"] = self.correlation_token
 
-        if len(self.context_properties) > 0:
-            response["context"]["properties"] = self.context_properties
+        event = {"header": header}
+        payload = dict(self.payload) if self.payload else {}
 
-        if len(self.payload_endpoints) > 0:
-            response["event"]["payload"]["endpoints"] = self.payload_endpoints
+        if self.name not in _NO_ENDPOINT:
+            endpoint = {
+                "scope": {
+                    "type": "BearerToken",
+                    "token": self.scope_token if self.scope_token is not None else "INVALID"
+                },
+                "endpointId": self.endpoint_id
+            }
+            if self.cookie is not None:
+                endpoint["cookie"] = self.cookie
+            event["endpoint"] = endpoint
 
-        if len(self.payload_properties) > 0:
-            response["event"]["payload"]["change"] = {
+        elif self.scope_token is not None and "scope" in payload:
+            payload["scope"] = dict(payload["scope"], token=self.scope_token)
+
+        if self.payload_endpoints:
+            payload["endpoints"] = self.payload_endpoints
+
+        if self.payload_properties:
+            payload["change"] = {
                 "cause": {"type": "PHYSICAL_INTERACTION"},
                 "properties": self.payload_properties
             }
 
         if self.payload_timestamp:
-            response["event"]["payload"]["cause"] = {"type": "PHYSICAL_INTERACTION"}
-            response["event"]["payload"]["timestamp"] = self.payload_timestamp
+            payload["cause"] = {"type": "PHYSICAL_INTERACTION"}
+            payload["timestamp"] = self.payload_timestamp
+
+        event["payload"] = payload
+        response = {"context": {}, "event": event}
+
+        if self.context_properties:
+            response["context"]["properties"] = self.context_properties
 
         if remove_empty:
             if len(response["context"]) < 1:
@@ -191,14 +219,27 @@ class AlexaResponse:
 
         return response
 
+    def encode(self, endpoint_fragments=None):
+        """Return the response as the UTF-8 JSON body posted to the gateway.
+
+        endpoint_fragments are pre-encoded endpoints, spliced in as payload.endpoints.
+        """
+        response = self.get()
+        if endpoint_fragments is None:
+            return json_encode(response)
+
+        response["event"]["payload"]["endpoints"] = FRAGMENTS
+        return splice_json(response, endpoint_fragments)
+
+    def set_scope_token(self, token):
+        # Discovery reports carry the scope in the payload, everything else in the endpoint
+        self.scope_token = token
+
     def set_payload(self, payload):
-        self.event["payload"] = payload
+        self.payload = payload
 
     def set_payload_endpoint(self, payload_endpoints):
         self.payload_endpoints = payload_endpoints
 
     def set_payload_endpoints(self, payload_endpoints):
-        if "endpoints" not in self.event["payload"]:
-            self.event["payload"]["endpoints"] = []
-
-        self.event["payload"]["endpoints"] = payload_endpoints
+        self.payload_endpoints = payload_endpoints
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
+
+from .gateway import GatewayError
+from .metrics import Metrics
+from .utils import write_atomic
+
+_LOGGER = logging.getLogger(__name__)
+
+TOKEN_LIFETIME = 3600
+# Refresh this long before the token expires, at most half its lifetime
+REFRESH_MARGIN = 300
+# Background refresh retries back off from REFRESH_RETRY up to REFRESH_RETRY_MAX
+REFRESH_RETRY = 30
+REFRESH_RETRY_MAX = 900
+
+
+class TokenManager:
+    """Keeps the LWA access token in memory for the life of the process.
+
+    The token cache file is read once and only written when a new token is
+    granted or refreshed. The token is refreshed in the background before it
+    expires, so callers normally never wait for LWA. Concurrent callers that
+    still find it expired share a single in-flight refresh.
+    """
+
+    def __init__(self, hass, client, url, client_id, client_secret, filename, metrics=None):
+        self._hass = hass
+        self._client = client
+        self._url = url
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._filename = filename
+        self._access_token = None
+        self._refresh_token = None
+        self._expires_at = 0.0
+        self._lifetime = TOKEN_LIFETIME
+        self._loaded = False
+        self._pending = None
+        self._timer = None
+        self._retries = 0
+        self._metrics = metrics if metrics is not None else Metrics()
+
+    async def async_get_token(self):
+        if self._access_token is not None and time.monotonic() < self._expires_at:
+            self._metrics.inc("alexa_gateway_token_requests_total", result="hit")
+            return self._access_token
+
+        self._metrics.inc("alexa_gateway_token_requests_total", result="miss")
+
+        if self._pending is None:
+            self._pending = self._hass.async_create_task(self._async_update())
+        # Shield the shared refresh so one cancelled caller can't abort it for all
+        return await asyncio.shield(self._pending)
+
+    @property
+    def linked(self):
+        """Whether a refresh token is at hand, None until AcceptGrant or once LWA rejected it."""
+        return self._refresh_token is not None
+
+    async def async_start(self):
+        if not self._loaded:
+            await self._async_load()
+        if self._refresh_token is not None:
+            self._schedule_refresh()
+
+    @callback
+    def async_stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    @callback
+    def async_invalidate(self, token):
+        # The gateway rejected the token, the next caller refreshes it
+        if token == self._access_token:
+            self._expires_at = 0.0
+
+    async def async_grant(self, code):
+        _LOGGER.debug("First time auth, need new token...")
+        token, refresh, lifetime = await grant_token(
+            self._client, self._url, self._client_id, self._client_secret, code)
+        await self._async_store(token, refresh, lifetime)
+        return token
+
+    def _schedule_refresh(self):
+        self.async_stop()
+        margin = min(REFRESH_MARGIN, self._lifetime / 2)
+        delay = max(0, self._expires_at - margin - time.monotonic())
+        self._timer = self._hass.loop.call_later(delay, self._refresh_due)
+
+    @callback
+    def _refresh_due(self):
+        self._timer = None
+        if self._pending is None:
+            self._pending = self._hass.async_create_task(self._async_update(force=True))
+        self._pending.add_done_callback(self._refreshed)
+
+    def _refreshed(self, task):
+        if not task.cancelled() and task.exception() is None:
+            return
+        if self._refresh_token is None or self._timer is not None:
+            # Rejected refresh token, nothing to retry until the next AcceptGrant
+            return
+        # The current token may still be valid, try again a little later each time
+        delay = min(REFRESH_RETRY * 2 ** self._retries, REFRESH_RETRY_MAX)
+        self._retries += 1
+        self._timer = self._hass.loop.call_later(delay, self._refresh_due)
+
+    async def _async_update(self, force=False):
+        try:
+            if not self._loaded:
+                await self._async_load()
+                if not force and self._access_token is not None and time.monotonic() < self._expires_at:
+                    return self._access_token
+
+            if self._refresh_token is None:
+                raise HomeAssistantError(
+                    "No Alexa Gateway token available, account linking (AcceptGrant) required")
+
+            _LOGGER.debug("Token expiring, refreshing token...")
+            self._metrics.inc("alexa_gateway_token_refreshes_total")
+            try:
+                token, refresh, lifetime = await refresh_token(
+                    self._client, self._url, self._client_id, self._client_secret, self._refresh_token)
+            except HomeAssistantError as err:
+                if is_rejected(err):
+                    # Skill disabled or refresh token revoked, LWA won't change its mind
+                    _LOGGER.warning("Refresh token rejected, account linking (AcceptGrant) required")
+                    self._refresh_token = None
+                raise
+            await self._async_store(token, refresh, lifetime)
+            return token
+        finally:
+            self._pending = None
+
+    async def _async_load(self):
+        cfg = await self._hass.async_add_executor_job(read_config, self._filename)
+        self._loaded = True
+        if not cfg:
+            return
+
+        self._access_token = cfg.get("access_token")
+        self._refresh_token = cfg.get("refresh_token")
+        try:
+            # The file keeps a wall clock expiration, convert it to the monotonic clock
+            remaining = (datetime.fromisoformat(cfg["expiration"]) - datetime.now()).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            remaining = 0
+        self._expires_at = time.monotonic() + remaining
+
+    async def _async_store(self, token, refresh, lifetime):
+        self._access_token = token
+        self._refresh_token = refresh
+        self._lifetime = lifetime
+        self._expires_at = time.monotonic() + lifetime
+        self._loaded = True
+        self._retries = 0
+        self._schedule_refresh()
+        cfg = {"access_token": token,
+               "refresh_token": refresh,
+               "expiration": str(datetime.now() + timedelta(seconds=lifetime))}
+        await self._hass.async_add_executor_job(write_config, self._filename, cfg)
+
+
+async def grant_token(client, url, client_id, client_secret, code):
+    try:
+        data = {"grant_type": "authorization_code",
+                "code": code,
+                "client_id": client_id,
+                "client_secret": client_secret}
+        payload = json.loads(await client.async_post_token(url, data))
+        return payload["access_token"], payload["refresh_token"], payload.get("expires_in", TOKEN_LIFETIME)
+    except Exception as err:
+        _LOGGER.error("Failed to grant token because %s", str(err))
+        raise HomeAssistantError("Failed to grant token") from err
+
+
+async def refresh_token(client, url, client_id, client_secret, token):
+    try:
+        data = {"grant_type": "refresh_token",
+                "refresh_token": token,
+                "client_id": client_id,
+                "client_secret": client_secret}
+        payload = json.loads(await client.async_post_token(url, data))
+        return payload["access_token"], payload["refresh_token"], payload.get("expires_in", TOKEN_LIFETIME)
+    except Exception as err:
+        _LOGGER.error("Failed to refresh token, because %s", str(err))
+        raise HomeAssistantError("Failed to refresh token") from err
+
+
+def is_rejected(err):
+    # A 4xx other than throttling means the request itself is refused, not LWA being down
+    cause = err.__cause__
+    return (isinstance(cause, GatewayError) and cause.status is not None
+            and 400 <= cause.status < 500 and cause.status != 429)
+
+
+def read_config(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (IOError, ValueError) as ex:
+        _LOGGER.error("Failed to read configuration file, because %s", ex)
+
+
+def write_config(filename, config):
+    try:
+        write_atomic(filename, json.dumps(config))
+    except IOError as ex:
+        _LOGGER.error("Failed to write configuration file, because %s", ex)
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+
+from homeassistant.const import ATTR_DEVICE_CLASS, ATTR_FRIENDLY_NAME, EVENT_STATE_CHANGED
+from homeassistant.core import callback
+
+from .const import ATTR_ALEXA_DISPLAY, ATTR_ALEXA_INTERFACE
+from .utils import write_atomic
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def entity_signature(state):
+    # Everything an endpoint descriptor is derived from, besides the domain
+    attributes = state.attributes
+    return (attributes.get(ATTR_DEVICE_CLASS),
+            attributes.get(ATTR_ALEXA_INTERFACE),
+            attributes.get(ATTR_ALEXA_DISPLAY),
+            attributes.get(ATTR_FRIENDLY_NAME))
+
+
+def chunked(items, max_count, max_size=None, size=None):
+    """Split items into lists of at most max_count items and max_size total size."""
+    chunk = []
+    total = 0
+    for item in items:
+        item_size = size(item) if size else 0
+        if chunk and (len(chunk) >= max_count or (max_size and total + item_size > max_size)):
+            yield chunk
+            chunk = []
+            total = 0
+        chunk.append(item)
+        total += item_size
+
+    if chunk:
+        yield chunk
+
+
+class CatalogEntry:
+    """Cached discovery data of one entity, endpoint is its encoded JSON descriptor."""
+    __slots__ = ("signature", "interfaces", "endpoint", "reported", "event_source", "digest")
+
+    def __init__(self, signature, interfaces, endpoint, reported, event_source):
+        self.signature = signature
+        self.interfaces = interfaces
+        self.endpoint = endpoint
+        self.reported = reported
+        self.event_source = event_source
+        self.digest = hashlib.sha1(endpoint).hexdigest() if endpoint is not None else None
+
+
+class EndpointCatalog:
+    """Discovery descriptors of every entity, kept up to date from state changes.
+
+    An entity is only described again when its signature changes, so state
+    updates cost a few attribute lookups and Discover is a read of the cache.
+    The digest of every endpoint sent to Alexa is remembered, so only what
+    changed since then has to be reported. With a filename these digests
+    are kept across restarts.
+    """
+
+    def __init__(self, hass, describe, filename=None):
+        self._hass = hass
+        self._describe = describe
+        self._filename = filename
+        self._entries = {}
+        self._listeners = []
+        self._discovered = {}
+        self._saving = False
+
+    async def async_load(self):
+        if self._filename is not None:
+            self._discovered = await self._hass.async_add_executor_job(read_discovered, self._filename)
+
+    @callback
+    def async_start(self):
+        for state in self._hass.states.async_all():
+            self._async_update(state)
+        return self._hass.bus.async_listen(EVENT_STATE_CHANGED, self._state_changed)
+
+    @callback
+    def async_add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def get(self, entity_id):
+        return self._entries.get(entity_id)
+
+    @property
+    def discovered(self):
+        return bool(self._discovered)
+
+    @callback
+    def async_get_changes(self, full=False):
+        """Return the entries added or changed and the ids removed since the last
+        discovery, with the digests to store once Alexa has them. With full every
+        entry counts as changed."""
+        changed = []
+        current = {}
+        for entity_id, entry in self._entries.items():
+            if entry.endpoint is None:
+                continue
+            current[entity_id] = entry.digest
+            if full or self._discovered.get(entity_id) != entry.digest:
+                changed.append(entry)
+
+        removed = [entity_id for entity_id in self._discovered if entity_id not in current]
+        return changed, removed, current
+
+    @callback
+    def async_set_discovered(self, discovered):
+        self._discovered = discovered
+        if self._filename is not None and not self._saving:
+            self._saving = True
+            self._hass.async_create_task(self._async_save())
+
+    async def _async_save(self):
+        # Writes the latest digests, however many updates came in during a write
+        try:
+            saved = None
+            while saved is not self._discovered:
+                saved = self._discovered
+                await self._hass.async_add_executor_job(write_discovered, self._filename, saved)
+        finally:
+            self._saving = False
+
+    @callback
+    def async_reset_discovered(self):
+        # Alexa may have lost the endpoints, like after linking the account again,
+        # send everything next time, also after a restart
+        self.async_set_discovered({})
+
+    @callback
+    def _async_update(self, state):
+        signature = entity_signature(state)
+        entry = self._entries.get(state.entity_id)
+        if entry is None or entry.signature != signature:
+            try:
+                entry = self._describe(state, signature)
+            except Exception as err:
+                _LOGGER.error("Failed to describe %s because %s", state.entity_id, err)
+                entry = CatalogEntry(signature, [], None, False, False)
+            self._entries[state.entity_id] = entry
+        return entry
+
+    @callback
+    def _state_changed(self, event):
+        new_state = event.data.get("new_state")
+        if new_state is None:
+            self._entries.pop(event.data["entity_id"], None)
+            return
+
+        entry = self._async_update(new_state)
+        for listener in self._listeners:
+            listener(entry, event.data.get("old_state"), new_state)
+
+
+def read_discovered(filename):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (IOError, ValueError) as ex:
+        _LOGGER.error("Failed to read discovery file, because %s", ex)
+        return {}
+
+
+def write_discovered(filename, discovered):
+    try:
+        write_atomic(filename, json.dumps(discovered))
+    except IOError as ex:
+        _LOGGER.error("Failed to write discovery file, because %s", ex)
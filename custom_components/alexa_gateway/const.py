@@ -0,0 +1,6 @@
+COMPONENT_DOMAIN = "alexa_gateway"
+
+ATTR_ALEXA_INTERFACE = "alexa_interface"
+ATTR_ALEXA_DISPLAY = "alexa_display"
+
+DATA_METRICS = "metrics"
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+# Alexa drops a directive response arriving more than about 8 seconds late
+DEFAULT_DIRECTIVE_TIMEOUT = 7
+# Kept out of the service call budget, to still post an ErrorResponse in time
+RESPONSE_RESERVE = 2
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+
+    def __init__(self, stage):
+        super().__init__("Deadline exceeded in {}".format(stage))
+        self.stage = stage
+
+
+class Deadline:
+    """Time budget of one directive, from the moment it arrived.
+
+    Every stage awaited through async_run gets what is left of the budget
+    and its duration is recorded, to tell which stage was slow.
+    """
+
+    def __init__(self, timeout=DEFAULT_DIRECTIVE_TIMEOUT):
+        self._start = time.monotonic()
+        self._expires = self._start + timeout
+        self.stages = []
+
+    def remaining(self, reserve=0):
+        return max(0, self._expires - reserve - time.monotonic())
+
+    async def async_run(self, stage, awaitable, reserve=0):
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining(reserve))
+        except asyncio.TimeoutError as err:
+            raise DeadlineExceeded(stage) from err
+        finally:
+            self.stages.append((stage, time.monotonic() - started))
+
+    def __str__(self):
+        timings = ", ".join("%s %.3fs" % stage for stage in self.stages)
+        return "%.3fs (%s)" % (time.monotonic() - self._start, timings)
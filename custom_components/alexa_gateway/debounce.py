@@ -0,0 +1,60 @@
+import logging
+
+from homeassistant.core import callback
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 1.0
+
+
+class ReportDebouncer:
+    """Coalesces ChangeReports per entity.
+
+    The first change for an entity opens a window, further changes inside the
+    window are absorbed, and when it closes a single report is built from the
+    entity's state at that moment, so it always carries the latest values.
+    Entities scheduled together share a window and are sent as one batch.
+    """
+
+    def __init__(self, hass, window, send):
+        self._hass = hass
+        self._window = window
+        self._send = send
+        self._pending = {}
+
+    @callback
+    def async_schedule(self, entity_ids, immediate=False):
+        if isinstance(entity_ids, str):
+            entity_ids = [entity_ids]
+
+        if immediate or self._window <= 0:
+            self._hass.async_create_task(self._async_send(list(entity_ids)))
+            return
+
+        batch = [entity_id for entity_id in entity_ids if entity_id not in self._pending]
+        if not batch:
+            return
+
+        handle = self._hass.loop.call_later(self._window, self._flush, batch)
+        for entity_id in batch:
+            self._pending[entity_id] = handle
+
+    @callback
+    def async_flush_all(self):
+        if not self._pending:
+            return
+        for handle in set(self._pending.values()):
+            handle.cancel()
+        self._flush(list(self._pending))
+
+    @callback
+    def _flush(self, batch):
+        for entity_id in batch:
+            self._pending.pop(entity_id, None)
+        self._hass.async_create_task(self._async_send(batch))
+
+    async def _async_send(self, entity_ids):
+        try:
+            await self._send(entity_ids)
+        except Exception as err:
+            _LOGGER.error("Failed to report change for %s because %s", ", ".join(entity_ids), err)
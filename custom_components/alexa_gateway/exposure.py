@@ -0,0 +1,56 @@
+import fnmatch
+import re
+
+CONF_INCLUDE_DOMAINS = "include_domains"
+CONF_INCLUDE_DEVICE_CLASSES = "include_device_classes"
+CONF_INCLUDE_ENTITY_GLOBS = "include_entity_globs"
+CONF_INCLUDE_ENTITIES = "include_entities"
+CONF_EXCLUDE_DOMAINS = "exclude_domains"
+CONF_EXCLUDE_DEVICE_CLASSES = "exclude_device_classes"
+CONF_EXCLUDE_ENTITY_GLOBS = "exclude_entity_globs"
+CONF_EXCLUDE_ENTITIES = "exclude_entities"
+
+
+def compile_globs(patterns):
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern.lower()) for pattern in patterns))
+
+
+class ExposureFilter:
+    """Which entities are exposed to Alexa, compiled once from the filter config.
+
+    Listed entities win over everything else, then any exclude rule hides an
+    entity, then with include rules only the entities matching one are exposed.
+    Without any rule every entity is exposed.
+    """
+
+    def __init__(self, conf):
+        self._include_entities = frozenset(conf.get(CONF_INCLUDE_ENTITIES, []))
+        self._exclude_entities = frozenset(conf.get(CONF_EXCLUDE_ENTITIES, []))
+        self._include_domains = frozenset(conf.get(CONF_INCLUDE_DOMAINS, []))
+        self._exclude_domains = frozenset(conf.get(CONF_EXCLUDE_DOMAINS, []))
+        self._include_device_classes = frozenset(conf.get(CONF_INCLUDE_DEVICE_CLASSES, []))
+        self._exclude_device_classes = frozenset(conf.get(CONF_EXCLUDE_DEVICE_CLASSES, []))
+        self._include_globs = compile_globs(conf.get(CONF_INCLUDE_ENTITY_GLOBS))
+        self._exclude_globs = compile_globs(conf.get(CONF_EXCLUDE_ENTITY_GLOBS))
+        self._has_includes = bool(self._include_entities or self._include_domains
+                                  or self._include_device_classes or self._include_globs)
+
+    def __call__(self, entity_id, device_class=None):
+        if entity_id in self._include_entities:
+            return True
+        if entity_id in self._exclude_entities:
+            return False
+
+        domain = entity_id.partition(".")[0]
+        if (domain in self._exclude_domains
+                or device_class in self._exclude_device_classes
+                or (self._exclude_globs is not None and self._exclude_globs.match(entity_id))):
+            return False
+
+        if not self._has_includes:
+            return True
+        return (domain in self._include_domains
+                or device_class in self._include_device_classes
+                or (self._include_globs is not None and self._include_globs.match(entity_id) is not None))
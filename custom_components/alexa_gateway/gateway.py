@@ -0,0 +1,114 @@
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .metrics import Metrics
+from .ratelimit import LANE_INTERACTIVE, LANE_REPORT
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRY_AFTER = 1
+# Longest throttling wait a directive response retries through before giving up
+MAX_INTERACTIVE_RETRY_AFTER = 2
+
+
+class GatewayError(HomeAssistantError):
+
+    def __init__(self, message, status=None, text=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.text = text
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class GatewayClient:
+    """Posts events to the Alexa Event Gateway and tokens requests to LWA.
+
+    Uses Home Assistant's shared aiohttp session, so connections to the gateway
+    are kept alive and pooled between events. Events go through the rate
+    limiter, in the lane given by the caller.
+    """
+
+    def __init__(self, hass, url, timeout=DEFAULT_TIMEOUT, limiter=None, metrics=None):
+        self._session = async_get_clientsession(hass)
+        self._url = url
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._limiter = limiter
+        self._metrics = metrics if metrics is not None else Metrics()
+
+    async def async_post_event(self, token, payload, lane=LANE_REPORT):
+        headers = {"Authorization": "Bearer {}".format(token),
+                   "Content-Type": "application/json;charset=UTF-8"}
+        kwargs = {"data": payload} if isinstance(payload, bytes) else {"json": payload}
+
+        retried = False
+        while True:
+            if self._limiter is not None:
+                await self._limiter.async_acquire(lane)
+            start = time.monotonic()
+            try:
+                status, text, response_headers = await self._async_post(self._url, headers, **kwargs)
+            except GatewayError:
+                self._metrics.inc("alexa_gateway_posts_total", status="error")
+                self._metrics.inc("alexa_gateway_post_errors_total")
+                raise
+            finally:
+                self._metrics.observe("alexa_gateway_post_seconds", time.monotonic() - start)
+            self._metrics.inc("alexa_gateway_posts_total", status=str(status))
+            _LOGGER.debug("Alexa Gateway post response: %s %s", status, text)
+            if status != 429:
+                break
+
+            retry_after = parse_retry_after(response_headers.get("Retry-After"))
+            if self._limiter is not None:
+                self._limiter.block(retry_after)
+            # Directive responses can't wait for the outbox, retry them once right away
+            if lane != LANE_INTERACTIVE or retried or retry_after > MAX_INTERACTIVE_RETRY_AFTER:
+                break
+            retried = True
+
+        if status >= 400:
+            self._metrics.inc("alexa_gateway_post_errors_total")
+            _LOGGER.error(
+                "Failed to send event to Alexa gateway because %s %s", status, text)
+            raise GatewayError("Alexa gateway returned {}".format(status), status, text,
+                               retry_after if status == 429 else None)
+        return status
+
+    async def async_post_token(self, url, data):
+        headers = {
+            "content-type": "application/x-www-form-urlencoded;charset=UTF-8"}
+        status, text, _ = await self._async_post(url, headers, data=data)
+        if status >= 400:
+            raise GatewayError("Token endpoint returned {}".format(status), status, text)
+        return text
+
+    async def _async_post(self, url, headers, **kwargs):
+        try:
+            async with self._session.post(url,
+                                          headers=headers,
+                                          timeout=self._timeout,
+                                          **kwargs) as response:
+                return response.status, await response.text(), response.headers
+        except (aiohttp.ClientError, TimeoutError) as err:
+            _LOGGER.error("Failed to post to %s because %s", url, repr(err))
+            raise GatewayError("Failed to post to {}".format(url)) from err
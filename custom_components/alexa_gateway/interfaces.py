@@ -0,0 +1,621 @@
+from functools import lru_cache
+
+from homeassistant.const import ATTR_DEVICE_CLASS
+
+from .alexa_response import AlexaResponse
+from .const import ATTR_ALEXA_INTERFACE
+from .utils import json_encode
+
+GARAGE_CLASSES = ["garage", "door", "gate"]
+BLIND_CLASSES = ["awning", "blind", "curtain", "shade", "shutter", "window"]
+
+DOMAIN_INTERFACES = {
+    "lock": ("Alexa.LockController", "Alexa"),
+    "light": ("Alexa.PowerController", "Alexa.BrightnessController",
+              "Alexa.ColorController", "Alexa.ColorTemperatureController", "Alexa"),
+    "switch": ("Alexa.PowerController", "Alexa"),
+    "input_boolean": ("Alexa.PowerController", "Alexa"),
+    "script": ("Alexa.PowerController", "Alexa"),
+    "climate": ("Alexa.TemperatureSensor", "Alexa.ThermostatController", "Alexa"),
+    "sensor": ("Alexa.ContactSensor", "Alexa"),
+    "binary_sensor": ("Alexa.ContactSensor", "Alexa"),
+    "counter": ("Alexa.RangeController", "Alexa"),
+}
+
+# Domains where the device_class picks the interfaces
+DEVICE_CLASS_INTERFACES = {
+    "cover": {
+        **{device_class: ("Alexa.ModeController", "Alexa") for device_class in GARAGE_CLASSES},
+        **{device_class: ("Alexa.RangeController", "Alexa") for device_class in BLIND_CLASSES},
+    },
+}
+
+DOMAIN_DISPLAY = {
+    "light": "LIGHT",
+    "lock": "SMARTLOCK",
+    "script": "ACTIVITY_TRIGGER",
+    "climate": "THERMOSTAT",
+    "camera": "CAMERA",
+}
+
+DEVICE_CLASS_DISPLAY = {
+    "garage": "GARAGE_DOOR",
+    "door": "DOOR",
+    "gate": "DOOR",
+    **{device_class: "INTERIOR_BLIND" for device_class in BLIND_CLASSES},
+}
+
+INTERFACES = {}
+
+_BUILDER = AlexaResponse()
+
+
+def get_interfaces(domain, attributes):
+    return _resolve_interfaces(domain,
+                               attributes.get(ATTR_DEVICE_CLASS),
+                               attributes.get(ATTR_ALEXA_INTERFACE))
+
+
+@lru_cache(maxsize=512)
+def _resolve_interfaces(domain, device_class, override_interface):
+    if not override_interface:
+        by_device_class = DEVICE_CLASS_INTERFACES.get(domain)
+        if by_device_class is not None:
+            return by_device_class.get(device_class, ())
+        return DOMAIN_INTERFACES.get(domain, ())
+
+    elif override_interface == "Alexa.DoorbellEventSource":
+        return ("Alexa.DoorbellEventSource",)
+
+    elif override_interface != "None":
+        return (override_interface, "Alexa")
+
+    return ()
+
+
+def get_display(domain, attributes):
+    display = DOMAIN_DISPLAY.get(domain)
+    if display is None:
+        display = DEVICE_CLASS_DISPLAY.get(attributes.get(ATTR_DEVICE_CLASS), "OTHER")
+    return display
+
+
+def get_interface(interface):
+    try:
+        return INTERFACES[interface]
+    except KeyError:
+        raise Exception(
+            f"Interface not yet implemented: {interface}") from None
+
+
+def register(cls):
+    """Register an interface class, collecting the methods marked with @directive."""
+    cls.directives = {}
+    for klass in reversed(cls.__mro__):
+        for attr in vars(klass).values():
+            for name in getattr(attr, "directive_names", ()):
+                cls.directives[name] = attr
+    INTERFACES[cls.name] = cls()
+    return cls
+
+
+def directive(*names):
+    def decorator(func):
+        func.directive_names = names
+        return func
+    return decorator
+
+
+def _thermostat_mode(state):
+    mode = state.state.upper()
+    return "AUTO" if mode == "HEAT_COOL" else mode
+
+
+class AlexaInterface:
+    name = "Alexa"
+    properties = ()
+    retrievable = True
+    proactively_reported = True
+    directives = {}
+    # Property name -> predicted value, given the service called and its data
+    future_values = {}
+    # Whether property_value reads the entity state, so a state change confirms it
+    confirmable = True
+    # Properties reported with a directive response that no directive sets,
+    # a change of these doesn't confirm one
+    untargeted = ()
+    # Event-style properties, every report is news even with the same value
+    always_report = False
+
+    def __init__(self):
+        self._fragments = {}
+
+    def instance(self, attributes):
+        return None
+
+    def variant(self, attributes):
+        # Entities of the same variant share one capability descriptor
+        return None
+
+    def capability_fragment(self, attributes):
+        """Return the capability encoded as JSON, built once per variant."""
+        variant = self.variant(attributes)
+        fragment = self._fragments.get(variant)
+        if fragment is None:
+            fragment = json_encode(self.capability(_BUILDER, attributes))
+            self._fragments[variant] = fragment
+        return fragment
+
+    def capability(self, alexa_response, attributes):
+        return alexa_response.create_payload_endpoint_capability(
+            interface=self.name,
+            supported=[{"name": name} for name in self.properties],
+            retrievable=self.retrievable,
+            proactively_reported=self.proactively_reported)
+
+    def property_value(self, name, state):
+        return state.state.upper()
+
+    def get_service(self, name, payload, state):
+        handler = self.directives.get(name)
+        if handler is None:
+            raise Exception(
+                f"Service not yet implemented for Interface: {self.name}; name: {name}")
+        return handler(self, name, payload, state)
+
+    def future_value(self, name, service, data, state):
+        predict = self.future_values.get(name)
+        if predict is None:
+            raise Exception(
+                f"Future value not yet implemented for name: {name}; service: {service}")
+        return predict(service, data, state)
+
+
+@register
+class Alexa(AlexaInterface):
+
+    def capability(self, alexa_response, attributes):
+        return alexa_response.create_payload_endpoint_capability()
+
+
+@register
+class DoorbellEventSource(AlexaInterface):
+    name = "Alexa.DoorbellEventSource"
+
+    def capability(self, alexa_response, attributes):
+        return alexa_response.create_payload_endpoint_capability(
+            interface=self.name,
+            proactively_reported=True)
+
+
+@register
+class LockController(AlexaInterface):
+    name = "Alexa.LockController"
+    properties = ("lockState",)
+    future_values = {
+        "lockState": lambda service, data, state: "LOCKED" if service == "lock" else "UNLOCKED",
+    }
+
+    @directive("Lock", "Unlock")
+    def lock(self, name, payload, state):
+        return name.lower(), {"entity_id": state.entity_id}
+
+
+@register
+class PowerController(AlexaInterface):
+    name = "Alexa.PowerController"
+    properties = ("powerState",)
+    future_values = {
+        "powerState": lambda service, data, state: "OFF" if service == "turn_off" else "ON",
+    }
+
+    @directive("TurnOn", "TurnOff")
+    def turn_on_off(self, name, payload, state):
+        service = "turn_off" if name == "TurnOff" else "turn_on"
+        return service, {"entity_id": state.entity_id}
+
+
+@register
+class BrightnessController(AlexaInterface):
+    name = "Alexa.BrightnessController"
+    properties = ("brightness",)
+    future_values = {
+        "brightness": lambda service, data, state: data["brightness_pct"],
+    }
+
+    def property_value(self, name, state):
+        brightness = state.attributes.get("brightness")
+        if brightness is None:
+            return 0
+        return round(brightness * 100 / 255)
+
+    @directive("SetBrightness")
+    def set_brightness(self, name, payload, state):
+        return "turn_on", {"entity_id": state.entity_id,
+                           "brightness_pct": payload["brightness"]}
+
+
+@register
+class ColorController(AlexaInterface):
+    name = "Alexa.ColorController"
+    properties = ("color",)
+    future_values = {
+        "color": lambda service, data, state: {"hue": data["hs_color"][0],
+                                               "saturation": data["hs_color"][1] / 100,
+                                               "brightness": 1.0},
+    }
+
+    confirmable = False
+
+    def property_value(self, name, state):
+        return {
+            "hue": 0.0,
+            "saturation": 0.0,
+            "brightness": 0.0
+        }
+
+    @directive("SetColor")
+    def set_color(self, name, payload, state):
+        return "turn_on", {"entity_id": state.entity_id,
+                           "hs_color": [payload["color"]["hue"], 100 * payload["color"]["saturation"]]}
+
+
+@register
+class ColorTemperatureController(AlexaInterface):
+    name = "Alexa.ColorTemperatureController"
+    properties = ("colorTemperatureInKelvin",)
+    future_values = {
+        "colorTemperatureInKelvin": lambda service, data, state: data["kelvin"],
+    }
+
+    confirmable = False
+
+    def property_value(self, name, state):
+        return 0
+
+    @directive("SetColorTemperature")
+    def set_color_temperature(self, name, payload, state):
+        return "turn_on", {"entity_id": state.entity_id,
+                           "kelvin": payload["colorTemperatureInKelvin"]}
+
+
+@register
+class TemperatureSensor(AlexaInterface):
+    name = "Alexa.TemperatureSensor"
+    properties = ("temperature",)
+
+    def property_value(self, name, state):
+        if state.domain == "climate":
+            return {"value": state.attributes.get("current_temperature"), "scale": "FAHRENHEIT"}
+        return {"value": state.state, "scale": "FAHRENHEIT"}
+
+
+class DetectionSensor(AlexaInterface):
+    properties = ("detectionState",)
+
+    def property_value(self, name, state):
+        if state.state.lower() == "open" or state.state.lower() == "on":
+            return "DETECTED"
+        return "NOT_DETECTED"
+
+
+@register
+class ContactSensor(DetectionSensor):
+    name = "Alexa.ContactSensor"
+
+
+@register
+class MotionSensor(DetectionSensor):
+    name = "Alexa.MotionSensor"
+
+
+@register
+class EventDetectionSensor(AlexaInterface):
+    name = "Alexa.EventDetectionSensor"
+    properties = ("humanPresenceDetectionState",)
+    retrievable = False
+    always_report = True
+
+    def property_value(self, name, state):
+        return {"value": "DETECTED"}
+
+
+@register
+class ThermostatController(AlexaInterface):
+    name = "Alexa.ThermostatController"
+    properties = ("targetSetpoint", "thermostatMode", "lowerSetpoint", "upperSetpoint")
+    retrievable = False
+    # targetSetpoint is the ambient temperature, the directives only set the setpoints
+    untargeted = ("targetSetpoint", "thermostatMode")
+    setpoint_attributes = {
+        "targetSetpoint": "current_temperature",
+        "lowerSetpoint": "target_temp_low",
+        "upperSetpoint": "target_temp_high",
+    }
+    future_values = {
+        "targetSetpoint": lambda service, data, state: {
+            "value": state.attributes.get("current_temperature"), "scale": "FAHRENHEIT"},
+        "thermostatMode": lambda service, data, state: _thermostat_mode(state),
+        "lowerSetpoint": lambda service, data, state: {
+            "value": data.get("target_temp_low", state.attributes.get("target_temp_low")), "scale": "FAHRENHEIT"},
+        "upperSetpoint": lambda service, data, state: {
+            "value": data.get("target_temp_high", state.attributes.get("target_temp_high")), "scale": "FAHRENHEIT"},
+    }
+
+    def capability(self, alexa_response, attributes):
+        return alexa_response.create_payload_endpoint_capability(
+            interface=self.name,
+            supported=[{"name": name} for name in self.properties],
+            configuration_modes=["HEAT", "COOL", "AUTO", "OFF"],
+            retrievable=self.retrievable,
+            proactively_reported=self.proactively_reported)
+
+    def property_value(self, name, state):
+        if name == "thermostatMode":
+            return _thermostat_mode(state)
+        return {"value": state.attributes.get(self.setpoint_attributes[name]), "scale": "FAHRENHEIT"}
+
+    @directive("AdjustTargetTemperature")
+    def adjust_target_temperature(self, name, payload, state):
+        data = {"entity_id": state.entity_id}
+        data["target_temp_high"] = state.attributes.get(
+            "target_temp_high") + payload["targetSetpointDelta"]["value"]
+        data["target_temp_low"] = state.attributes.get(
+            "target_temp_low") + payload["targetSetpointDelta"]["value"]
+        return "set_temperature", data
+
+    @directive("SetTargetTemperature")
+    def set_target_temperature(self, name, payload, state):
+        data = {"entity_id": state.entity_id}
+        if "upperSetpoint" in payload: data["target_temp_high"] = payload["upperSetpoint"]["value"]
+        if "lowerSetpoint" in payload: data["target_temp_low"] = payload["lowerSetpoint"]["value"]
+        if "targetSetpoint" in payload:
+            data["target_temp_high"] = payload["targetSetpoint"]["value"] + 4
+            data["target_temp_low"] = payload["targetSetpoint"]["value"] - 4
+        return "set_temperature", data
+
+
+@register
+class ModeController(AlexaInterface):
+    name = "Alexa.ModeController"
+    properties = ("mode",)
+    future_values = {
+        "mode": lambda service, data, state: "Position.Up" if service == "open_cover" else "Position.Down",
+    }
+
+    def instance(self, attributes):
+        if attributes.get(ATTR_DEVICE_CLASS) in GARAGE_CLASSES:
+            return "GarageDoor.Position"
+        return None
+
+    def variant(self, attributes):
+        return attributes.get(ATTR_DEVICE_CLASS) in GARAGE_CLASSES
+
+    def capability(self, alexa_response, attributes):
+        if attributes.get(ATTR_DEVICE_CLASS) not in GARAGE_CLASSES:
+            raise Exception(
+                f"Capability not yet implemented for Interface: {self.name}")
+
+        return alexa_response.create_payload_endpoint_capability(
+            interface=self.name,
+            instance=self.instance(attributes),
+            supported=[{"name": name} for name in self.properties],
+            retrievable=True,
+            proactively_reported=True,
+            capability_resources={"friendlyNames": [
+                {"@type": "asset", "value": {"assetId": "Alexa.Setting.Mode"}}]},
+            configuration_modes=[
+                {
+                    "value": "Position.Up",
+                    "modeResources": {
+                        "friendlyNames": [
+                            {
+                                "@type": "asset",
+                                "value": {
+                                    "assetId": "Alexa.Value.Open"
+                                }
+                            },
+                            {
+                                "@type": "text",
+                                "value": {
+                                    "text": "Open",
+                                    "locale": "en-US"
+                                }
+                            }
+                        ]
+                    }
+                },
+                {
+                    "value": "Position.Down",
+                    "modeResources": {
+                        "friendlyNames": [
+                            {
+                                "@type": "asset",
+                                "value": {
+                                    "assetId": "Alexa.Value.Close"
+                                }
+                            },
+                            {
+                                "@type": "text",
+                                "value": {
+                                    "text": "Closed",
+                                    "locale": "en-US"
+                                }
+                            }
+                        ]
+                    }
+                }
+            ],
+            configuration_ordered=False,
+            semantics_actions=[
+                {
+                    "@type": "ActionsToDirective",
+                    "actions": ["Alexa.Actions.Close", "Alexa.Actions.Lower"],
+                    "directive": {
+                        "name": "SetMode",
+                        "payload": {
+                            "mode": "Position.Down"
+                        }
+                    }
+                },
+                {
+                    "@type": "ActionsToDirective",
+                    "actions": ["Alexa.Actions.Open", "Alexa.Actions.Raise"],
+                    "directive": {
+                        "name": "SetMode",
+                        "payload": {
+                            "mode": "Position.Up"
+                        }
+                    }
+                }
+            ],
+            semantics_states=[
+                {
+                    "@type": "StatesToValue",
+                    "states": ["Alexa.States.Closed"],
+                    "value": "Position.Down"
+                },
+                {
+                    "@type": "StatesToValue",
+                    "states": ["Alexa.States.Open"],
+                    "value": "Position.Up"
+                }
+            ])
+
+    def property_value(self, name, state):
+        if state.state.lower() == "open":
+            return "Position.Up"
+        elif state.state.lower() == "closed":
+            return "Position.Down"
+        return "INVALID"
+
+    @directive("SetMode")
+    def set_mode(self, name, payload, state):
+        service = "open_cover" if payload["mode"] == "Position.Up" else "close_cover"
+        return service, {"entity_id": state.entity_id}
+
+
+@register
+class RangeController(AlexaInterface):
+    name = "Alexa.RangeController"
+    properties = ("rangeValue",)
+
+    def instance(self, attributes):
+        if attributes.get(ATTR_DEVICE_CLASS) in BLIND_CLASSES:
+            return "Blind.Lift"
+        return "Counter.Number"
+
+    def variant(self, attributes):
+        return attributes.get(ATTR_DEVICE_CLASS) in BLIND_CLASSES
+
+    def capability(self, alexa_response, attributes):
+        if attributes.get(ATTR_DEVICE_CLASS) not in BLIND_CLASSES:
+            return alexa_response.create_payload_endpoint_capability(
+                interface=self.name,
+                instance=self.instance(attributes),
+                supported=[{"name": name} for name in self.properties],
+                retrievable=True,
+                proactively_reported=True,
+                capability_resources={"friendlyNames": [
+                    {"@type": "text", "value": {"text": "number", "locale": "en-US"}}]},
+                configuration_range={"minimumValue": 0, "maximumValue": 100, "precision": 1})
+
+        # TO-DO: Set "rangeValueDelta" from the state attributes step
+        return alexa_response.create_payload_endpoint_capability(
+            interface=self.name,
+            instance=self.instance(attributes),
+            supported=[{"name": name} for name in self.properties],
+            retrievable=True,
+            proactively_reported=True,
+            capability_resources={"friendlyNames": [
+                {"@type": "asset", "value": {"assetId": "Alexa.Setting.Opening"}}]},
+            configuration_range={"minimumValue": 0, "maximumValue": 100, "precision": 1},
+            unit_of_measure="Alexa.Unit.Percent",
+            semantics_actions=[
+                  {
+                    "@type": "ActionsToDirective",
+                    "actions": ["Alexa.Actions.Close"],
+                    "directive": {
+                      "name": "SetRangeValue",
+                      "payload": {
+                        "rangeValue": 0
+                      }
+                    }
+                  },
+                  {
+                    "@type": "ActionsToDirective",
+                    "actions": ["Alexa.Actions.Open"],
+                    "directive": {
+                      "name": "SetRangeValue",
+                      "payload": {
+                        "rangeValue": 100
+                      }
+                    }
+                  },
+                  {
+                    "@type": "ActionsToDirective",
+                    "actions": ["Alexa.Actions.Lower"],
+                    "directive": {
+                      "name": "AdjustRangeValue",
+                      "payload": {
+                        "rangeValueDelta" : -10,
+                        "rangeValueDeltaDefault" : False
+                      }
+                    }
+                  },
+                  {
+                    "@type": "ActionsToDirective",
+                    "actions": ["Alexa.Actions.Raise"],
+                    "directive": {
+                      "name": "AdjustRangeValue",
+                      "payload": {
+                        "rangeValueDelta" : 10,
+                        "rangeValueDeltaDefault" : False
+                      }
+                    }
+                  }
+                ],
+            semantics_states=[
+                  {
+                    "@type": "StatesToValue",
+                    "states": ["Alexa.States.Closed"],
+                    "value": 0
+                  },
+                  {
+                    "@type": "StatesToRange",
+                    "states": ["Alexa.States.Open"],
+                    "range": {
+                      "minimumValue": 1,
+                      "maximumValue": 100
+                    }
+                  }
+                ])
+
+    def property_value(self, name, state):
+        if state.domain == "cover":
+            return state.attributes.get("current_position")
+        return int(state.state)
+
+    def future_value(self, name, service, data, state):
+        if service == "increment":
+            return int(state.state) + 1
+        elif service == "decrement":
+            return int(state.state) - 1
+        elif service == "configure":
+            return data["value"]
+        return data["position"]
+
+    @directive("AdjustRangeValue")
+    def adjust_range_value(self, name, payload, state):
+        if state.domain == "cover":
+            return "set_cover_position", {"entity_id": state.entity_id,
+                                          "position": state.attributes.get("current_position") + payload["rangeValueDelta"]}
+
+        service = "increment" if payload["rangeValueDelta"] > 0 else "decrement"
+        return service, {"entity_id": state.entity_id}
+
+    @directive("SetRangeValue")
+    def set_range_value(self, name, payload, state):
+        if state.domain == "cover":
+            return "set_cover_position", {"entity_id": state.entity_id, "position": payload["rangeValue"]}
+        return "configure", {"entity_id": state.entity_id, "value": payload["rangeValue"]}
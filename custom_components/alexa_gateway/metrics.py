@@ -0,0 +1,167 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+from homeassistant.components.http import HomeAssistantView
+
+# Upper bounds in seconds, Alexa gives a directive about 8 seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Seconds per window of the recent quantiles
+RECENT_WINDOW = 300
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "_recent", "_previous", "_rotated")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # Bucket counts of the current and the previous window, for recent quantiles
+        self._recent = [0] * len(self.counts)
+        self._previous = [0] * len(self.counts)
+        self._rotated = time.monotonic()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self._rotate()
+        self._recent[index] += 1
+
+    def quantile(self, q):
+        return estimate_quantile(self.buckets, self.counts, q)
+
+    def recent_quantile(self, q):
+        """Estimate a quantile over the last RECENT_WINDOW to 2 * RECENT_WINDOW seconds.
+
+        After days of uptime a regression hardly moves the cumulative quantile,
+        so the sensors alerted on use this one.
+        """
+        self._rotate()
+        return estimate_quantile(self.buckets, [previous + recent for previous, recent
+                                                in zip(self._previous, self._recent)], q)
+
+    def _rotate(self):
+        now = time.monotonic()
+        elapsed = now - self._rotated
+        if elapsed < RECENT_WINDOW:
+            return
+        self._previous = self._recent if elapsed < 2 * RECENT_WINDOW else [0] * len(self.counts)
+        self._recent = [0] * len(self.counts)
+        self._rotated = now
+
+
+def estimate_quantile(buckets, counts, q):
+    """Estimate a quantile by interpolating inside its bucket, like Prometheus does."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if index == len(buckets):
+                return buckets[-1]
+            lower = buckets[index - 1] if index else 0
+            return lower + (buckets[index] - lower) * (rank - seen) / count
+        seen += count
+    return buckets[-1]
+
+
+class Metrics:
+    """Counters and latency histograms of the component, by name and labels.
+
+    Everything is updated in the event loop, so plain ints and floats do.
+    Gauges are read from a callback when the metrics are rendered.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    # Labels are keyword arguments, so the metric name can't be called name
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, metric, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(metric, time.monotonic() - start, **labels)
+
+    def add_gauge(self, name, value):
+        self._gauges[name] = value
+
+    def counter(self, metric, **labels):
+        """Sum of the counter over every label set matching labels."""
+        return sum(value for (key, key_labels), value in self._counters.items()
+                   if key == metric and set(labels.items()) <= set(key_labels))
+
+    def histogram(self, metric, **labels):
+        return self._histograms.get((metric, tuple(sorted(labels.items()))))
+
+    def gauge(self, name):
+        return self._gauges[name]()
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, value in sorted(self._gauges.items()):
+            lines.append("# TYPE %s gauge" % name)
+            lines.append("%s %s" % (name, value()))
+
+        typed = set()
+        for (name, labels), value in sorted(self._counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s counter" % name)
+            lines.append("%s%s %s" % (name, format_labels(labels), value))
+
+        for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s histogram" % name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append("%s_bucket%s %s" % (name, format_labels(labels + (("le", str(bound)),)), cumulative))
+            lines.append("%s_sum%s %s" % (name, format_labels(labels), histogram.sum))
+            lines.append("%s_count%s %s" % (name, format_labels(labels), histogram.count))
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsView(HomeAssistantView):
+    """Metrics in the Prometheus text format, for scraping with a long-lived token."""
+
+    url = "/api/alexa_gateway/metrics"
+    name = "api:alexa_gateway:metrics"
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    async def get(self, request):
+        return web.Response(text=self._metrics.render(), content_type="text/plain")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                             for key, value in labels)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from homeassistant.core import callback
+
+from .gateway import GatewayError
+from .utils import write_atomic
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1000
+MAX_ATTEMPTS = 20
+BACKOFF_BASE = 5
+BACKOFF_MAX = 900
+# Rewrite the journal once it holds this many more records than live entries
+COMPACT_SLACK = 500
+
+
+def is_retryable(err):
+    # Network errors, expired tokens, throttling and gateway failures are worth
+    # retrying, any other rejection of the message will not change later
+    if not isinstance(err, GatewayError):
+        err = err.__cause__
+        if not isinstance(err, GatewayError):
+            return False
+    return err.status is None or err.status in (401, 429) or err.status >= 500
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxEntry:
+    __slots__ = ("id", "key", "body", "attempts", "due")
+
+    def __init__(self, entry_id, key, body):
+        self.id = entry_id
+        self.key = key
+        self.body = body
+        self.attempts = 0
+        self.due = 0.0
+
+
+class RetryOutbox:
+    """Gateway messages that failed to post, retried until they go through.
+
+    Entries are kept in an append-only journal file, so they survive a
+    restart. A newer message with the same key (the ChangeReport of an
+    endpoint) supersedes the pending one, which keeps the backlog bounded by
+    the number of endpoints during a long outage. send gets the entry and
+    should check it is still pending right before posting it.
+    """
+
+    def __init__(self, hass, filename, send, max_entries=DEFAULT_MAX_ENTRIES):
+        self._hass = hass
+        self._filename = filename
+        self._send = send
+        self._max_entries = max_entries
+        self._entries = {}
+        self._keys = {}
+        self._next_id = 0
+        self._records = 0
+        self._journal = []
+        self._write_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._blocked_until = 0.0
+        self._task = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def async_start(self):
+        records = await self._hass.async_add_executor_job(read_journal, self._filename)
+        for record in records:
+            if "add" in record:
+                self._insert(OutboxEntry(record["add"], record.get("key"), record["body"]))
+                self._next_id = max(self._next_id, record["add"] + 1)
+            elif "done" in record:
+                self._remove(record["done"])
+
+        if self._entries:
+            _LOGGER.info("Retrying %s Alexa gateway messages from the outbox", len(self._entries))
+        self._records = len(records)
+        await self._async_compact()
+        self._task = self._hass.async_create_background_task(
+            self._async_run(), "alexa_gateway outbox")
+
+    async def async_stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self._async_flush()
+
+    @callback
+    def async_add(self, key, body):
+        if key is not None:
+            self.async_discard(key)
+
+        if len(self._entries) >= self._max_entries:
+            oldest = next(iter(self._entries.values()))
+            _LOGGER.warning("Outbox full, dropping message %s", oldest.key or oldest.id)
+            self._done(oldest)
+
+        entry = OutboxEntry(self._next_id, key, body)
+        self._next_id += 1
+        entry.due = time.monotonic() + backoff(0)
+        self._insert(entry)
+        self._append({"add": entry.id, "key": key, "body": body})
+        self._wakeup.set()
+
+    def pending(self, entry):
+        """Whether the entry still waits to be sent, not superseded, discarded or dropped."""
+        return self._entries.get(entry.id) is entry
+
+    @callback
+    def async_discard(self, key):
+        entry_id = self._keys.get(key)
+        if entry_id is not None:
+            self._done(self._entries[entry_id])
+
+    def _insert(self, entry):
+        self._entries[entry.id] = entry
+        if entry.key is not None:
+            # Replaying the journal, an older entry for the key is superseded
+            previous = self._keys.get(entry.key)
+            if previous is not None:
+                self._remove(previous)
+            self._keys[entry.key] = entry.id
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None and entry.key is not None and self._keys.get(entry.key) == entry_id:
+            del self._keys[entry.key]
+        return entry
+
+    def _done(self, entry):
+        if self._remove(entry.id) is not None:
+            self._append({"done": entry.id})
+
+    def _append(self, record):
+        self._journal.append(json.dumps(record))
+        self._records += 1
+        if len(self._journal) == 1:
+            self._hass.async_create_task(self._async_flush())
+
+    async def _async_flush(self):
+        async with self._write_lock:
+            if self._records - len(self._entries) > COMPACT_SLACK:
+                await self._async_compact()
+                return
+
+            lines, self._journal = self._journal, []
+            if lines:
+                await self._hass.async_add_executor_job(append_journal, self._filename, lines)
+
+    async def _async_compact(self):
+        self._journal = []
+        lines = [json.dumps({"add": entry.id, "key": entry.key, "body": entry.body})
+                 for entry in self._entries.values()]
+        self._records = len(lines)
+        await self._hass.async_add_executor_job(write_journal, self._filename, lines)
+
+    async def _async_run(self):
+        while True:
+            now = time.monotonic()
+            due = [entry for entry in self._entries.values() if entry.due <= now]
+            if not due or now < self._blocked_until:
+                wake = min((entry.due for entry in self._entries.values()), default=None)
+                if wake is not None:
+                    wake = max(wake, self._blocked_until)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if wake is None else wake - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for entry in due:
+                if entry.id not in self._entries:
+                    continue
+                if not await self._async_retry(entry):
+                    break
+
+    async def _async_retry(self, entry):
+        try:
+            await self._send(entry)
+        except Exception as err:
+            entry.attempts += 1
+            if not is_retryable(err) or entry.attempts >= MAX_ATTEMPTS:
+                _LOGGER.error("Dropping Alexa gateway message %s after %s attempts because %s",
+                              entry.key or entry.id, entry.attempts, err)
+                self._done(entry)
+                return True
+
+            # The gateway is still failing, hold off every entry not just this one
+            delay = backoff(entry.attempts)
+            entry.due = time.monotonic() + delay
+            self._blocked_until = entry.due
+            _LOGGER.debug("Outbox retry failed, next attempt in %.0fs", delay)
+            return False
+
+        self._done(entry)
+        return True
+
+
+def read_journal(filename):
+    records = []
+    try:
+        with open(filename, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn last line after a crash
+                    _LOGGER.warning("Skipping corrupt outbox record")
+    except FileNotFoundError:
+        pass
+    except IOError as ex:
+        _LOGGER.error("Failed to read outbox file, because %s", ex)
+    return records
+
+
+def append_journal(filename, lines):
+    try:
+        with open(filename, "a") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except IOError as ex:
+        _LOGGER.error("Failed to write outbox file, because %s", ex)
+
+
+def write_journal(filename, lines):
+    try:
+        write_atomic(filename, "".join(line + "\n" for line in lines))
+    except IOError as ex:
+        _LOGGER.error("Failed to write outbox file, because %s", ex)
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+from homeassistant.core import callback
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+
+class ReportPipeline:
+    """Posts reports a few at a time, in submission order per endpoint.
+
+    A report waits for the previous one of its endpoint, so an older state
+    can never overtake a newer one, while reports of different endpoints
+    share the concurrency slots.
+    """
+
+    def __init__(self, hass, send, concurrency=DEFAULT_CONCURRENCY):
+        self._hass = hass
+        self._send = send
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tails = {}
+
+    @callback
+    def async_submit(self, key, item, send=None):
+        previous = self._tails.get(key)
+        task = self._hass.async_create_task(self._async_run(previous, item, send or self._send))
+        self._tails[key] = task
+        task.add_done_callback(lambda done: self._done(key, done))
+        return task
+
+    def _done(self, key, task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _async_run(self, previous, item, send):
+        if previous is not None:
+            # Only the order matters, a failed predecessor doesn't stop this one
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            await send(item)
+
+
+class EntityLocks:
+    """One FIFO lock per endpoint, dropped as soon as nobody holds or waits for it."""
+
+    def __init__(self):
+        # Key -> [lock, number of holders and waiters]
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    async def async_acquire(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._leave(key, entry)
+            raise
+
+    def release(self, key):
+        entry = self._locks[key]
+        entry[0].release()
+        self._leave(key, entry)
+
+    def _leave(self, key, entry):
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[key]
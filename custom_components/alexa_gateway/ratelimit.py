@@ -0,0 +1,84 @@
+import asyncio
+import time
+from collections import deque
+
+# Lanes in priority order, a waiting message in a lower lane is only sent when
+# no message waits in a higher one
+LANE_INTERACTIVE = 0
+LANE_REPORT = 1
+LANE_BULK = 2
+
+DEFAULT_RATE = 10
+DEFAULT_BURST = 20
+
+
+class RateLimiter:
+    """Token bucket in front of the Alexa Event Gateway.
+
+    A throttled post blocks the bucket for the Retry-After time the gateway
+    asked for, and waiting messages are released lane by lane.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lanes = (deque(), deque(), deque())
+        self._timer = None
+
+    def waiting(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    async def async_acquire(self, lane=LANE_REPORT):
+        if not self.waiting() and self._take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append(future)
+        self._release()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before being cancelled, hand the token back
+                self._tokens = min(self._burst, self._tokens + 1)
+                self._release()
+            elif future in self._lanes[lane]:
+                self._lanes[lane].remove(future)
+            raise
+
+    def block(self, seconds):
+        # The bucket starts refilling once the block is over, not during it
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._blocked_until
+
+    def _take(self):
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return False
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _release(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        for lane in self._lanes:
+            while lane:
+                if lane[0].done():
+                    lane.popleft()
+                    continue
+                if not self._take():
+                    now = time.monotonic()
+                    delay = max(self._blocked_until - now, 0) + max((1 - self._tokens) / self._rate, 0)
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._release)
+                    return
+                lane.popleft().set_result(None)
@@ -0,0 +1,57 @@
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import UnitOfTime
+
+from .const import COMPONENT_DOMAIN, DATA_METRICS
+
+
+def quantile(name, q):
+    def value(metrics):
+        histogram = metrics.histogram(name)
+        estimate = histogram.recent_quantile(q) if histogram is not None else None
+        return round(estimate * 1000, 1) if estimate is not None else None
+    return value
+
+
+# Name, unit, state class and how the value is read from the metrics
+SENSORS = (
+    ("Directive latency p99", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT,
+     quantile("alexa_gateway_directive_seconds", 0.99)),
+    ("Directive latency p50", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT,
+     quantile("alexa_gateway_directive_seconds", 0.5)),
+    ("Post latency p99", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT,
+     quantile("alexa_gateway_post_seconds", 0.99)),
+    ("Directives", None, SensorStateClass.TOTAL_INCREASING,
+     lambda metrics: metrics.counter("alexa_gateway_directives_total")),
+    ("Posts", None, SensorStateClass.TOTAL_INCREASING,
+     lambda metrics: metrics.counter("alexa_gateway_posts_total")),
+    ("Post errors", None, SensorStateClass.TOTAL_INCREASING,
+     lambda metrics: metrics.counter("alexa_gateway_post_errors_total")),
+    ("Token refreshes", None, SensorStateClass.TOTAL_INCREASING,
+     lambda metrics: metrics.counter("alexa_gateway_token_refreshes_total")),
+    ("Outbox", None, SensorStateClass.MEASUREMENT,
+     lambda metrics: metrics.gauge("alexa_gateway_outbox_entries")),
+)
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    if discovery_info is None:
+        return
+
+    metrics = hass.data[COMPONENT_DOMAIN][DATA_METRICS]
+    async_add_entities([MetricSensor(metrics, *sensor) for sensor in SENSORS])
+
+
+class MetricSensor(SensorEntity):
+    """One metric of the component, polled from the in-memory metrics."""
+
+    def __init__(self, metrics, name, unit, state_class, value):
+        self._metrics = metrics
+        self._value = value
+        self._attr_name = "Alexa Gateway {}".format(name)
+        self._attr_unique_id = "{}_{}".format(COMPONENT_DOMAIN, name.lower().replace(" ", "_"))
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = state_class
+
+    @property
+    def native_value(self):
+        return self._value(self._metrics)
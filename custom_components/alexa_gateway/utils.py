@@ -11,10 +11,53 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import json
+import os
+import tempfile
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Placeholder swapped for a list of pre-encoded JSON fragments by splice_json
+FRAGMENTS = "@@fragments@@"
+_FRAGMENTS_TOKEN = b'"' + FRAGMENTS.encode("utf-8") + b'"'
+
+# Placeholder encoded in place of the scope token, swapped in right before posting
+SCOPE_TOKEN = "@@token@@"
+
 
 def get_utc_timestamp(seconds=None):
-    return time.strftime('%Y-%m-%dT%H:%M:%S.00Z', time.gmtime(seconds))
+    if seconds is None:
+        seconds = time.time()
+    return "%s.%03dZ" % (time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)), int(seconds % 1 * 1000))
+
+
+def json_encode(obj):
+    # orjson when installed (Home Assistant ships it), the stdlib otherwise
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def splice_json(obj, fragments):
+    # Encode obj with its FRAGMENTS placeholder replaced by a JSON array of fragments
+    return json_encode(obj).replace(_FRAGMENTS_TOKEN, b"[" + b",".join(fragments) + b"]", 1)
 
 
+def write_atomic(filename, text):
+    # Write to a temp file in the same directory and rename, so a crash never
+    # leaves a truncated file behind
+    directory = os.path.dirname(filename) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".alexa-gateway.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,282 @@
+"""Benchmark the alexa_gateway handlers against a synthetic Home Assistant.
+
+Drives describe_entity, discovery_handler, report_handler, service_handler and
+change_handler (each including the encoding of its response) over fake states
+covering every supported domain and device class, and reports ops/sec,
+p50/p99 latency and peak memory.
+
+    python tools/benchmark.py --entities 100 1000 10000 50000
+
+Runs without Home Assistant installed, minimal stand-ins are used for the
+modules the component imports when the real ones are missing.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Values the component actually reads, anything else imported is a placeholder
+STAND_INS = {
+    "homeassistant.core": {"callback": lambda func: func},
+    "homeassistant.exceptions": {"HomeAssistantError": type("HomeAssistantError", (Exception,), {})},
+    "homeassistant.const": {"ATTR_DEVICE_CLASS": "device_class",
+                            "ATTR_FRIENDLY_NAME": "friendly_name",
+                            "EVENT_STATE_CHANGED": "state_changed",
+                            "STATE_ON": "on"},
+    "aiohttp": {"ClientError": type("ClientError", (Exception,), {})},
+}
+STAND_IN_MODULES = ("homeassistant", "homeassistant.core", "homeassistant.exceptions",
+                    "homeassistant.const", "homeassistant.helpers", "homeassistant.helpers.aiohttp_client",
+                    "homeassistant.helpers.debounce", "homeassistant.helpers.discovery",
+                    "homeassistant.helpers.entity_registry", "homeassistant.helpers.event",
+                    "homeassistant.helpers.group", "homeassistant.helpers.typing",
+                    "homeassistant.components", "homeassistant.components.http",
+                    "homeassistant.components.sensor", "aiohttp", "aiohttp.web")
+
+
+def install_stand_ins():
+    for package in ("homeassistant", "aiohttp"):
+        try:
+            __import__(package)
+            continue
+        except ImportError:
+            pass
+
+        for name in STAND_IN_MODULES:
+            if name.split(".")[0] != package:
+                continue
+            module = types.ModuleType(name)
+            module.__dict__.update(STAND_INS.get(name, {}))
+            module.__getattr__ = lambda attr: type(attr, (), {})
+            sys.modules[name] = module
+            parent, _, child = name.rpartition(".")
+            if parent:
+                setattr(sys.modules[parent], child, module)
+
+
+install_stand_ins()
+
+from custom_components.alexa_gateway import (  # noqa: E402
+    DATA_CATALOG, DATA_REPORTED, change_handler, describe_entity, discovery_handler, report_handler, service_handler)
+from custom_components.alexa_gateway.catalog import EndpointCatalog, entity_signature  # noqa: E402
+from custom_components.alexa_gateway.const import COMPONENT_DOMAIN  # noqa: E402
+from custom_components.alexa_gateway.deadline import Deadline  # noqa: E402
+from custom_components.alexa_gateway.interfaces import BLIND_CLASSES, GARAGE_CLASSES  # noqa: E402
+
+# Domain, state, attributes and the directive sent to it, None for sensors
+TEMPLATES = [
+    ("light", "on", {"brightness": 128},
+     ("Alexa.BrightnessController", "SetBrightness", {"brightness": 40})),
+    ("switch", "off", {}, ("Alexa.PowerController", "TurnOn", {})),
+    ("input_boolean", "on", {}, ("Alexa.PowerController", "TurnOff", {})),
+    ("script", "off", {}, ("Alexa.PowerController", "TurnOn", {})),
+    ("lock", "locked", {}, ("Alexa.LockController", "Unlock", {})),
+    ("climate", "heat_cool", {"current_temperature": 70, "target_temp_low": 66, "target_temp_high": 74},
+     ("Alexa.ThermostatController", "AdjustTargetTemperature", {"targetSetpointDelta": {"value": 2}})),
+    ("counter", "3", {}, ("Alexa.RangeController", "AdjustRangeValue", {"rangeValueDelta": 1})),
+    ("sensor", "on", {}, None),
+    ("binary_sensor", "on", {"device_class": "door"}, None),
+    ("script", "off", {"alexa_interface": "Alexa.DoorbellEventSource", "alexa_display": "DOORBELL"}, None),
+    ("sun", "above_horizon", {}, None),
+]
+TEMPLATES += [("cover", "closed", {"device_class": device_class},
+               ("Alexa.ModeController", "SetMode", {"mode": "Position.Up"}))
+              for device_class in GARAGE_CLASSES]
+TEMPLATES += [("cover", "open", {"device_class": device_class, "current_position": 40},
+               ("Alexa.RangeController", "SetRangeValue", {"rangeValue": 50}))
+              for device_class in BLIND_CLASSES]
+
+
+class State:
+    __slots__ = ("entity_id", "domain", "state", "attributes")
+
+    def __init__(self, entity_id, state, attributes):
+        self.entity_id = entity_id
+        self.domain = entity_id.partition(".")[0]
+        self.state = state
+        self.attributes = attributes
+
+
+class FakeStates:
+
+    def __init__(self, states):
+        self._states = {state.entity_id: state for state in states}
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+    def async_all(self):
+        return list(self._states.values())
+
+    def async_entity_ids(self):
+        return list(self._states)
+
+
+class FakeBus:
+
+    def async_listen(self, event_type, listener):
+        return lambda: None
+
+
+class FakeServices:
+
+    async def async_call(self, domain, service, data, blocking=False):
+        return None
+
+
+class FakeHass:
+    """Just enough of Home Assistant for the handlers, services do nothing."""
+
+    def __init__(self, states):
+        self.states = FakeStates(states)
+        self.bus = FakeBus()
+        self.services = FakeServices()
+        self.data = {}
+
+    def async_create_task(self, target):
+        return asyncio.get_running_loop().create_task(target)
+
+
+def synthetic_states(count):
+    states = []
+    directives = []
+    for index in range(count):
+        domain, state, attributes, directive = TEMPLATES[index % len(TEMPLATES)]
+        entity_id = "%s.bench_%d" % (domain, index)
+        states.append(State(entity_id, state, dict(attributes, friendly_name="Bench %d" % index)))
+        if directive is not None:
+            namespace, name, payload = directive
+            directives.append({"directive": {
+                "header": {"namespace": namespace, "name": name, "correlationToken": "bench",
+                           "messageId": str(index), "payloadVersion": "3"},
+                "endpoint": {"endpointId": entity_id, "scope": {"type": "BearerToken", "token": "bench"}},
+                "payload": payload}})
+    return states, directives
+
+
+def report_request(entity_id):
+    return {"directive": {
+        "header": {"namespace": "Alexa", "name": "ReportState", "correlationToken": "bench",
+                   "messageId": "1", "payloadVersion": "3"},
+        "endpoint": {"endpointId": entity_id, "scope": {"type": "BearerToken", "token": "bench"}},
+        "payload": {}}}
+
+
+async def run_discovery(hass):
+    catalog = hass.data[COMPONENT_DOMAIN][DATA_CATALOG]
+    catalog.async_reset_discovered()
+    changed, removed, discovered = catalog.async_get_changes()
+    for alexa_response, endpoints in discovery_handler(changed, removed):
+        alexa_response.encode(endpoints)
+    catalog.async_set_discovered(discovered)
+
+
+def benchmarks(hass, states, directives, repeat):
+    catalog = hass.data[COMPONENT_DOMAIN][DATA_CATALOG]
+    reported = [state.entity_id for state in states
+                if catalog.get(state.entity_id) is not None and catalog.get(state.entity_id).reported]
+
+    async def describe(state):
+        describe_entity(state, entity_signature(state))
+
+    async def report(entity_id):
+        (await report_handler(hass, report_request(entity_id))).encode()
+
+    async def service(request):
+        (await service_handler(hass, request, Deadline(60))).encode()
+
+    async def change(entity_id):
+        # Forget the last report, so every call builds a full ChangeReport
+        hass.data[COMPONENT_DOMAIN][DATA_REPORTED].pop(entity_id, None)
+        (await change_handler(hass, entity_id)).encode()
+
+    async def unchanged(entity_id):
+        await change_handler(hass, entity_id)
+
+    async def discovery(_):
+        await run_discovery(hass)
+
+    return (("describe_entity", describe, states),
+            ("discovery_handler", discovery, range(repeat)),
+            ("report_handler", report, reported),
+            ("service_handler", service, directives),
+            ("change_handler", change, reported),
+            ("change_unchanged", unchanged, reported))
+
+
+async def measure(operation, items):
+    samples = []
+    clock = time.perf_counter
+    for item in items:
+        start = clock()
+        await operation(item)
+        samples.append(clock() - start)
+
+    tracemalloc.start()
+    for item in items:
+        await operation(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return samples, peak
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def run(count, repeat):
+    states, directives = synthetic_states(count)
+    hass = FakeHass(states)
+    catalog = EndpointCatalog(hass, describe_entity)
+    hass.data[COMPONENT_DOMAIN] = {DATA_CATALOG: catalog, DATA_REPORTED: {}}
+    catalog.async_start()
+
+    results = []
+    for name, operation, items in benchmarks(hass, states, directives, repeat):
+        items = list(items)
+        if not items:
+            continue
+        gc.collect()
+        samples, peak = await measure(operation, items)
+        samples.sort()
+        total = sum(samples)
+        results.append({"benchmark": name,
+                        "entities": count,
+                        "ops": len(samples),
+                        "ops_per_sec": len(samples) / total if total else float("inf"),
+                        "p50_us": percentile(samples, 0.5) * 1e6,
+                        "p99_us": percentile(samples, 0.99) * 1e6,
+                        "peak_kib": peak / 1024})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entities", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="entity counts to run, e.g. 100 1000 10000 50000")
+    parser.add_argument("--repeat", type=int, default=5, help="full discovery passes per count")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    if not args.json:
+        print("%-18s %8s %8s %12s %10s %10s %10s" % (
+            "benchmark", "entities", "ops", "ops/sec", "p50 us", "p99 us", "peak KiB"))
+    for count in args.entities:
+        for result in asyncio.run(run(count, args.repeat)):
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print("%-18s %8d %8d %12.0f %10.1f %10.1f %10.1f" % (
+                    result["benchmark"], result["entities"], result["ops"], result["ops_per_sec"],
+                    result["p50_us"], result["p99_us"], result["peak_kib"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Local stand-in for the Alexa Event Gateway and the LWA token endpoint.
+
+Accepts events and token requests like the Amazon endpoints do, with
+configurable latency, token lifetime and injected 401, 429 and 5xx answers,
+to exercise throughput, retries and throttling without network access.
+
+    python tools/fake_gateway.py --port 8765 --latency 0.05 --throttle-rate 0.1
+
+and point the component at it:
+
+    alexa_gateway:
+      url: http://localhost:8765/v3/events
+      auth_url: http://localhost:8765/auth/o2/token
+
+GET /stats returns the counts of what was received and answered.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+_LOGGER = logging.getLogger("fake_gateway")
+
+
+class FakeGateway:
+
+    def __init__(self, args):
+        self._args = args
+        self._random = random.Random(args.seed)
+        self._serial = itertools.count(1)
+        # Access token -> monotonic expiration
+        self._tokens = {}
+        self._refresh_tokens = set()
+        self._allowance = args.max_rate
+        self._updated = time.monotonic()
+        self.stats = Counter()
+
+    async def events(self, request):
+        await self._delay()
+        body = await request.read()
+        try:
+            header = json.loads(body)["event"]["header"]
+            self.stats["event:" + header["namespace"] + "." + header["name"]] += 1
+        except (ValueError, KeyError, TypeError):
+            return self._answer(400, {"code": "INVALID_REQUEST_EXCEPTION", "description": "Malformed event"})
+
+        token = request.headers.get("Authorization", "").partition("Bearer ")[2]
+        if self._tokens.get(token, 0) < time.monotonic() or self._roll(self._args.unauthorized_rate):
+            return self._answer(401, {"code": "INVALID_ACCESS_TOKEN_EXCEPTION",
+                                      "description": "Access token is not valid"})
+        if not self._admit() or self._roll(self._args.throttle_rate):
+            return self._answer(429, {"code": "THROTTLING_EXCEPTION", "description": "Request rate exceeded"},
+                                {"Retry-After": str(self._args.retry_after)})
+        if self._roll(self._args.error_rate):
+            return self._answer(self._random.choice((500, 502, 503)),
+                                {"code": "INTERNAL_SERVICE_EXCEPTION", "description": "Injected failure"})
+        return self._answer(202, None)
+
+    async def token(self, request):
+        await self._delay()
+        form = await request.post()
+        grant_type = form.get("grant_type")
+        self.stats["token:" + str(grant_type)] += 1
+
+        if grant_type == "refresh_token" and form.get("refresh_token") not in self._refresh_tokens:
+            return self._answer(400, {"error": "invalid_grant", "error_description": "Unknown refresh token"})
+        if grant_type not in ("authorization_code", "refresh_token"):
+            return self._answer(400, {"error": "unsupported_grant_type"})
+        if self._roll(self._args.error_rate):
+            return self._answer(503, {"error": "server_error"})
+
+        serial = next(self._serial)
+        access_token = "Atza|fake-access-%d" % serial
+        refresh_token = form.get("refresh_token") or "Atzr|fake-refresh-%d" % serial
+        self._tokens[access_token] = time.monotonic() + self._args.token_lifetime
+        self._refresh_tokens.add(refresh_token)
+        return self._answer(200, {"access_token": access_token,
+                                  "refresh_token": refresh_token,
+                                  "token_type": "bearer",
+                                  "expires_in": self._args.token_lifetime})
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    def _answer(self, status, payload, headers=None):
+        self.stats["status:%d" % status] += 1
+        if payload is None:
+            return web.Response(status=status)
+        return web.json_response(payload, status=status, headers=headers)
+
+    def _admit(self):
+        # Token bucket of max_rate events per second, 0 for no limit
+        if not self._args.max_rate:
+            return True
+        now = time.monotonic()
+        self._allowance = min(self._args.max_rate,
+                              self._allowance + (now - self._updated) * self._args.max_rate)
+        self._updated = now
+        if self._allowance < 1:
+            return False
+        self._allowance -= 1
+        return True
+
+    def _roll(self, rate):
+        return rate > 0 and self._random.random() < rate
+
+    async def _delay(self):
+        latency = self._args.latency + self._random.uniform(0, self._args.jitter)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+
+def create_app(args):
+    gateway = FakeGateway(args)
+    app = web.Application()
+    app.router.add_post("/v3/events", gateway.events)
+    app.router.add_post("/auth/o2/token", gateway.token)
+    app.router.add_get("/stats", gateway.get_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--token-lifetime", type=int, default=3600, help="access token lifetime in seconds")
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0, help="share of events answered 401")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of events answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 5xx")
+    parser.add_argument("--max-rate", type=float, default=0.0, help="events per second before answering 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of a 429")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible fault injection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(args), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Stand-in for the lambda, sends a directive to process_request and prints the answer.
+
+Calls the process_request service through the Home Assistant REST API with
+return_response, like the lambda does in synchronous mode, and prints the
+Alexa response the component returns, to try directives without Alexa.
+
+    python tools/process_request.py --token $HA_TOKEN Alexa.PowerController.TurnOn switch.fan
+    python tools/process_request.py --token $HA_TOKEN Alexa.ReportState light.kitchen
+    python tools/process_request.py --token $HA_TOKEN Alexa.Discovery.Discover
+
+--payload sets the directive payload, like the grant of an
+Alexa.Authorization.AcceptGrant, --file sends a whole directive read from a
+JSON file instead. Needs aiohttp.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+
+import aiohttp
+
+SERVICE_PATH = "/api/services/alexa_gateway/process_request?return_response"
+
+
+def build_directive(directive, entity_id, payload, scope_token):
+    # Alexa.ReportState splits into the bare Alexa namespace and ReportState
+    namespace, _, name = directive.rpartition(".")
+    header = {"namespace": namespace,
+              "name": name,
+              "messageId": str(uuid.uuid4()),
+              "correlationToken": str(uuid.uuid4()),
+              "payloadVersion": "3"}
+    request = {"directive": {"header": header, "payload": payload}}
+    if namespace == "Alexa.Discovery":
+        del header["correlationToken"]
+        request["directive"]["payload"] = dict(payload, scope={"type": "BearerToken", "token": scope_token})
+    elif namespace != "Alexa.Authorization":
+        if entity_id is None:
+            raise SystemExit("%s needs an entity id" % directive)
+        request["directive"]["endpoint"] = {"endpointId": entity_id,
+                                            "scope": {"type": "BearerToken", "token": scope_token}}
+    return request
+
+
+async def send(url, token, request, timeout):
+    headers = {"Authorization": "Bearer " + token}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async with session.post(url.rstrip("/") + SERVICE_PATH, json=request, headers=headers) as response:
+            text = await response.text()
+            if response.status != 200:
+                raise SystemExit("Home Assistant answered %d: %s" % (response.status, text))
+            return json.loads(text).get("service_response")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directive", nargs="?", help="namespace and name, e.g. Alexa.PowerController.TurnOn")
+    parser.add_argument("entity_id", nargs="?", help="endpoint of the directive")
+    parser.add_argument("--url", default="http://localhost:8123", help="Home Assistant base URL")
+    parser.add_argument("--token", required=True, help="Home Assistant long-lived access token")
+    parser.add_argument("--payload", default="{}", help="directive payload as JSON")
+    parser.add_argument("--file", help="JSON file holding a whole directive request to send")
+    parser.add_argument("--scope-token", default="stand-in", help="scope token of the directive")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for the answer")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            request = json.load(f)
+    elif args.directive:
+        request = build_directive(args.directive, args.entity_id, json.loads(args.payload), args.scope_token)
+    else:
+        parser.error("a directive or --file is required")
+
+    response = asyncio.run(send(args.url, args.token, request, args.timeout))
+    json.dump(response, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()